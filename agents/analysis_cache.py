@@ -0,0 +1,197 @@
+from typing import Any, Dict, List, Optional, Tuple
+from collections import OrderedDict
+from threading import Lock
+import copy
+import json
+import os
+import sqlite3
+import time
+
+# Number of analyses kept in memory (LRU), and an optional SQLite file that
+# keeps them across restarts.
+ANALYSIS_CACHE_SIZE = int(os.getenv("ANALYSIS_CACHE_SIZE", "128"))
+ANALYSIS_CACHE_PATH = os.getenv("ANALYSIS_CACHE_PATH")
+# Without a cache file, the blob lists kept for incremental analysis
+# stay in memory, least recently used first out beyond this many bytes.
+# With a file they are stored only there and read when needed.
+ANALYSIS_CACHE_PATHS_MAX_BYTES = int(os.getenv("ANALYSIS_CACHE_PATHS_MAX_BYTES", str(64 * 1024 * 1024)))
+
+
+class AnalysisCache:
+    """LRU cache of repository analyses keyed by (project, commit SHA).
+
+    A commit SHA names immutable content, so an entry never goes stale; a
+    moved branch simply resolves to a different key. The last analyzed SHA
+    of each branch is remembered too, as the base for incremental updates,
+    along with the complete blob list of analyses that walked the whole
+    tree (the stored structure lists only MAX_LISTED_PATHS paths).
+    """
+
+    def __init__(self, max_entries: int, path: Optional[str] = None, max_path_bytes: int = ANALYSIS_CACHE_PATHS_MAX_BYTES):
+        self.max_entries = max_entries
+        self.path = path
+        self.max_path_bytes = max_path_bytes
+        self._entries = OrderedDict()
+        self._paths = OrderedDict()  # key -> encoded blob list (in-memory mode only)
+        self._path_bytes = 0
+        self._heads = OrderedDict()  # "project@branch" -> sha
+        self._lock = Lock()
+        self._db = None
+        self.hits = 0
+        self.misses = 0
+        if path:
+            self._load()
+
+    @staticmethod
+    def _key(project_id: Any, sha: str) -> str:
+        return f"{project_id}@{sha}"
+
+    def _load(self):
+        self._db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS analyses (key TEXT PRIMARY KEY, used_at REAL NOT NULL, data TEXT NOT NULL)"
+        )
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS tree_paths (key TEXT PRIMARY KEY, paths TEXT NOT NULL)"
+        )
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS heads (key TEXT PRIMARY KEY, sha TEXT NOT NULL, updated_at REAL NOT NULL)"
+        )
+        rows = self._db.execute(
+            "SELECT key, data FROM analyses ORDER BY used_at DESC LIMIT ?", (self.max_entries,)
+        ).fetchall()
+        for key, data in reversed(rows):
+            self._entries[key] = json.loads(data)
+        for key, sha in self._db.execute("SELECT key, sha FROM heads ORDER BY updated_at").fetchall():
+            self._heads[key] = sha
+        # Drop anything beyond the size limit left by an earlier configuration
+        self._db.execute(
+            "DELETE FROM analyses WHERE key NOT IN (SELECT key FROM analyses ORDER BY used_at DESC LIMIT ?)",
+            (self.max_entries,),
+        )
+        self._db.execute("DELETE FROM tree_paths WHERE key NOT IN (SELECT key FROM analyses)")
+
+    def get(self, project_id: Any, sha: str) -> Optional[Dict[str, Any]]:
+        key = self._key(project_id, sha)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            if self._db is not None:
+                self._db.execute("UPDATE analyses SET used_at = ? WHERE key = ?", (time.time(), key))
+            return copy.deepcopy(entry)
+
+    @staticmethod
+    def _encode_blobs(blobs: List[Tuple[str, Optional[str]]]) -> str:
+        # One "sha<TAB>path" line per blob; a blob SHA never contains a tab
+        return "\n".join(f"{blob_id or ''}\t{path}" for path, blob_id in blobs)
+
+    @staticmethod
+    def _decode_blobs(joined: str) -> List[Tuple[str, Optional[str]]]:
+        blobs = []
+        for line in joined.split("\n") if joined else []:
+            blob_id, tab, path = line.partition("\t")
+            # Lines without a tab are bare paths written by older versions
+            blobs.append((path, blob_id or None) if tab else (line, None))
+        return blobs
+
+    def get_blobs(self, project_id: Any, sha: str) -> Optional[List[Tuple[str, Optional[str]]]]:
+        """Return every blob of a cached analysis as (path, blob SHA or None), if its tree walk completed"""
+        key = self._key(project_id, sha)
+        with self._lock:
+            if key not in self._entries:
+                return None
+            if self._db is not None:
+                row = self._db.execute("SELECT paths FROM tree_paths WHERE key = ?", (key,)).fetchone()
+                paths = row[0] if row else None
+            else:
+                paths = self._paths.get(key)
+                if paths is not None:
+                    self._paths.move_to_end(key)
+        if paths is None:
+            return None
+        return self._decode_blobs(paths)
+
+    def _drop_paths(self, key: str):
+        paths = self._paths.pop(key, None)
+        if paths is not None:
+            self._path_bytes -= len(paths)
+
+    def _keep_paths(self, key: str, joined: Optional[str]):
+        """Hold a path list in memory within max_path_bytes (in-memory mode)"""
+        self._drop_paths(key)
+        if joined is None or len(joined) > self.max_path_bytes:
+            return
+        self._paths[key] = joined
+        self._path_bytes += len(joined)
+        while self._path_bytes > self.max_path_bytes:
+            self._drop_paths(next(iter(self._paths)))
+
+    def put(self, project_id: Any, sha: str, result: Dict[str, Any], blobs: Optional[List[Tuple[str, Optional[str]]]] = None):
+        if self.max_entries <= 0:
+            return
+        key = self._key(project_id, sha)
+        entry = copy.deepcopy(result)
+        joined = self._encode_blobs(blobs) if blobs is not None else None
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            if self._db is None:
+                self._keep_paths(key, joined)
+            evicted = []
+            while len(self._entries) > self.max_entries:
+                evicted.append(self._entries.popitem(last=False)[0])
+                self._drop_paths(evicted[-1])
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO analyses (key, used_at, data) VALUES (?, ?, ?)",
+                    (key, time.time(), json.dumps(entry)),
+                )
+                if joined is not None:
+                    self._db.execute("INSERT OR REPLACE INTO tree_paths (key, paths) VALUES (?, ?)", (key, joined))
+                else:
+                    self._db.execute("DELETE FROM tree_paths WHERE key = ?", (key,))
+                self._db.executemany("DELETE FROM analyses WHERE key = ?", [(k,) for k in evicted])
+                self._db.executemany("DELETE FROM tree_paths WHERE key = ?", [(k,) for k in evicted])
+
+    def get_head(self, project_id: Any, branch: str) -> Optional[str]:
+        """Return the SHA of the last analysis recorded for a branch"""
+        with self._lock:
+            return self._heads.get(self._key(project_id, branch))
+
+    def set_head(self, project_id: Any, branch: str, sha: str):
+        key = self._key(project_id, branch)
+        with self._lock:
+            self._heads[key] = sha
+            self._heads.move_to_end(key)
+            # Heads are tiny, but only useful while their analysis is cached
+            while len(self._heads) > self.max_entries * 4:
+                stale = self._heads.popitem(last=False)[0]
+                if self._db is not None:
+                    self._db.execute("DELETE FROM heads WHERE key = ?", (stale,))
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO heads (key, sha, updated_at) VALUES (?, ?, ?)",
+                    (key, sha, time.time()),
+                )
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_entries,
+                "persistent": self._db is not None,
+                "path_lists_in_memory": len(self._paths),
+                "path_bytes_in_memory": self._path_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+analysis_cache = AnalysisCache(ANALYSIS_CACHE_SIZE, ANALYSIS_CACHE_PATH)
@@ -1,10 +1,10 @@
 from abc import ABC, abstractmethod
-from typing import Any, Dict, List
+from typing import Any, Callable, Dict, List
 import os
 from dotenv import load_dotenv
-import openai
-import asyncio
-from datetime import datetime, timedelta
+from .llm_scheduler import llm_scheduler, estimate_tokens, INTERACTIVE
+from .openai_client import get_openai_client
+from .llm_cache import llm_cache, llm_cache_key
 
 # Load environment variables if not already loaded
 load_dotenv()
@@ -27,14 +27,14 @@ class BaseAgent(ABC):
         self.openai_model = os.getenv("OPENAI_MODEL", "gpt-3.5-turbo")  # Default to 3.5-turbo
         if not self.openai_api_key:
             print("Warning: OPENAI_API_KEY environment variable is not set.")
-        # Set OpenAI API key globally for the SDK
-        openai.api_key = self.openai_api_key
         
-        # Rate limiting setup
-        self.last_request_time = datetime.now()
-        self.min_request_interval = 1.0  # Minimum seconds between requests
-        self.request_queue = asyncio.Queue()
-        self.processing = False
+        self.max_tokens = 1024  # Reduced from 2048
+        self.temperature = 0.2
+        
+        # Rate limiting is done by the process-wide LLM scheduler; these
+        # pick this agent's priority class and fair-queuing bucket there
+        self.llm_priority = INTERACTIVE
+        self.llm_client_id = "default"
 
     def _format_error(self, error: Exception) -> Dict[str, Any]:
         """Format error response"""
@@ -53,6 +53,16 @@ class BaseAgent(ABC):
             "data": data,
         }
     
+    def _report_progress(self, context: Dict[str, Any], stage: str, **info: Any) -> None:
+        """Forward a stage update to the context's progress callback, if any"""
+        progress = context.get("progress")
+        if progress is None:
+            return
+        try:
+            progress(stage, **info)
+        except Exception as e:
+            print(f"Progress reporting failed for stage {stage}: {e}")
+
     def _get_template(self, template_name: str) -> str:
         """Get a template by name"""
         try:
@@ -83,29 +93,13 @@ class BaseAgent(ABC):
         """
         pass 
 
-    async def _process_queue(self):
-        """Process queued requests with rate limiting"""
-        while True:
-            if not self.request_queue.empty():
-                future, prompt, system_prompt = await self.request_queue.get()
-                try:
-                    # Ensure minimum time between requests
-                    now = datetime.now()
-                    time_since_last = (now - self.last_request_time).total_seconds()
-                    if time_since_last < self.min_request_interval:
-                        await asyncio.sleep(self.min_request_interval - time_since_last)
-                    
-                    result = await self._make_openai_request(prompt, system_prompt)
-                    future.set_result(result)
-                    self.last_request_time = datetime.now()
-                except Exception as e:
-                    future.set_exception(e)
-                finally:
-                    self.request_queue.task_done()
-            await asyncio.sleep(0.1)
-
-    async def _make_openai_request(self, prompt: str, system_prompt: str = None) -> str:
-        """Make the actual OpenAI API request"""
+    async def _make_openai_request(self, prompt: str, system_prompt: str = None, on_token: Callable[[str], None] = None, json_mode: bool = False) -> str:
+        """Make the actual OpenAI API request
+        
+        When ``on_token`` is given the response is streamed and the callback
+        receives the accumulated text after every chunk. ``json_mode`` asks
+        for a response that is a single JSON object.
+        """
         if not self.openai_api_key:
             raise ValueError("OPENAI_API_KEY is not set.")
         
@@ -114,22 +108,56 @@ class BaseAgent(ABC):
             messages.append({"role": "system", "content": system_prompt})
         messages.append({"role": "user", "content": prompt})
         
-        response = await asyncio.get_event_loop().run_in_executor(
-            None,
-            lambda: openai.chat.completions.create(
+        options = {}
+        if json_mode:
+            options["response_format"] = {"type": "json_object"}
+        
+        client = get_openai_client()
+        if on_token is None:
+            response = await client.chat.completions.create(
                 model=self.openai_model,
                 messages=messages,
-                max_tokens=1024,  # Reduced from 2048
-                temperature=0.2,
+                max_tokens=self.max_tokens,
+                temperature=self.temperature,
+                **options,
             )
+            return response.choices[0].message.content.strip()
+        
+        stream = await client.chat.completions.create(
+            model=self.openai_model,
+            messages=messages,
+            max_tokens=self.max_tokens,
+            temperature=self.temperature,
+            stream=True,
+            **options,
         )
-        return response.choices[0].message.content.strip()
+        parts = []
+        async for chunk in stream:
+            delta = chunk.choices[0].delta.content if chunk.choices else None
+            if delta:
+                parts.append(delta)
+                on_token("".join(parts))
+        return "".join(parts).strip()
 
-    async def _call_openai(self, prompt: str, system_prompt: str = None) -> str:
-        """Call OpenAI's chat completion API with rate limiting"""
-        if not hasattr(self, '_queue_processor'):
-            self._queue_processor = asyncio.create_task(self._process_queue())
+    async def _call_openai(self, prompt: str, system_prompt: str = None, priority: int = None, on_token: Callable[[str], None] = None, use_cache: bool = True, json_mode: bool = False) -> str:
+        """Call OpenAI's chat completion API through the shared rate-limited scheduler
         
-        future = asyncio.Future()
-        await self.request_queue.put((future, prompt, system_prompt))
-        return await future 
\ No newline at end of file
+        Responses are cached on disk by (model, system prompt, normalized
+        prompt, temperature, JSON mode); a cached response skips the scheduler entirely.
+        """
+        key = llm_cache_key(self.openai_model, system_prompt, prompt, self.temperature, json_mode) if use_cache else None
+        if key is not None:
+            cached = llm_cache.get(key)
+            if cached is not None:
+                if on_token is not None:
+                    on_token(cached)
+                return cached
+        response = await llm_scheduler.submit(
+            lambda: self._make_openai_request(prompt, system_prompt, on_token, json_mode),
+            priority=self.llm_priority if priority is None else priority,
+            client_id=self.llm_client_id,
+            tokens=estimate_tokens(prompt, system_prompt) + self.max_tokens,
+        )
+        if key is not None and response:
+            llm_cache.put(key, response)
+        return response
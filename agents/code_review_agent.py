@@ -0,0 +1,577 @@
+from typing import Any, Dict, List, Optional, Tuple
+from .base_agent import BaseAgent
+from .gitlab_client import AsyncGitLab
+from .llm_scheduler import BATCH
+from .review_selection import is_reviewable_content
+from .review_chunking import (
+    chunk_file, pack_chunks, render_chunk, locate_finding, changed_line_ranges, expand_ranges, count_tokens, REVIEW_CHUNK_TOKENS
+)
+from .llm_cache import DiskCache, LLM_CACHE_PATH
+from .openai_client import OPENAI_JSON_MODE, model_context_tokens
+from .structured_output import parse_review, parse_batch_review, StructuredOutputError
+import asyncio
+import hashlib
+import json
+import os
+
+# Prompts (or content fetches) in flight at once, the default number of
+# files per review, and how often a failed OpenAI call is retried.
+REVIEW_CONCURRENCY = int(os.getenv("REVIEW_CONCURRENCY", "4"))
+REVIEW_MAX_FILES = int(os.getenv("REVIEW_MAX_FILES", "100"))
+REVIEW_MAX_RETRIES = int(os.getenv("REVIEW_MAX_RETRIES", "2"))
+REVIEW_RETRY_DELAY = float(os.getenv("REVIEW_RETRY_DELAY", "1.0"))
+# Upper bound on a request's max_files, and the token budget for the
+# findings and recommendations sent to the final summary prompt.
+REVIEW_MAX_FILES_LIMIT = int(os.getenv("REVIEW_MAX_FILES_LIMIT", "500"))
+REVIEW_SUMMARY_TOKENS = int(os.getenv("REVIEW_SUMMARY_TOKENS", "6000"))
+SEVERITY_RANK = {"critical": 0, "high": 1, "medium": 2, "low": 3, "info": 4}
+# Batch mode: rendered code tokens per prompt, response token limit, and
+# how many times files missing from a batch response are asked for again.
+# Batches are further capped so prompt and response fit the model's context.
+REVIEW_BATCH_TOKENS = int(os.getenv("REVIEW_BATCH_TOKENS", "12000"))
+REVIEW_BATCH_MAX_TOKENS = int(os.getenv("REVIEW_BATCH_MAX_TOKENS", "4096"))
+REVIEW_BATCH_RETRY_ROUNDS = int(os.getenv("REVIEW_BATCH_RETRY_ROUNDS", "1"))
+
+# Per-file review results, keyed by blob SHA, kept next to the LLM response
+# cache by default. Bump REVIEW_PROMPT_VERSION whenever the review prompts
+# change so results produced by older prompts are not served.
+REVIEW_CACHE_PATH = os.getenv("REVIEW_CACHE_PATH", LLM_CACHE_PATH)
+REVIEW_CACHE_MAX_BYTES = int(os.getenv("REVIEW_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+REVIEW_PROMPT_VERSION = "1"
+
+review_cache = DiskCache(REVIEW_CACHE_PATH, REVIEW_CACHE_MAX_BYTES, table="file_reviews")
+
+
+def git_blob_sha(content: str) -> str:
+    """The SHA git (and GitLab's tree ``id``) assigns to a blob with this content"""
+    data = content.encode("utf-8")
+    return hashlib.sha1(b"blob %d\0" % len(data) + data).hexdigest()
+
+
+class CodeReviewAgent(BaseAgent):
+    def __init__(self, gitlab_client: AsyncGitLab):
+        """Initialize the CodeReviewAgent with the GitLab client used to fetch file contents"""
+        super().__init__()
+        self.gitlab = gitlab_client
+        # Per-file reviews are bulk work; let interactive calls go first
+        self.llm_priority = BATCH
+        self.concurrency = REVIEW_CONCURRENCY
+        self.max_retries = REVIEW_MAX_RETRIES
+        self.chunk_tokens = REVIEW_CHUNK_TOKENS
+        self.batch = False
+        self.diff_mode = False
+        self.json_mode = OPENAI_JSON_MODE
+
+    def enable_batch_mode(self):
+        """Pack many files per prompt and ask for one JSON review per file"""
+        self.batch = True
+        self.max_tokens = REVIEW_BATCH_MAX_TOKENS
+
+    def _cache_key(self, blob_sha: str, focus_areas: List[str], regions: Optional[List[Tuple[int, int]]]) -> str:
+        payload = json.dumps([
+            blob_sha,
+            self.review_settings(focus_areas),
+            [list(region) for region in regions] if regions else None,
+        ], sort_keys=True)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _cached_review(self, path: str, key: str) -> Optional[Dict[str, Any]]:
+        cached = review_cache.get(key)
+        if cached is None:
+            return None
+        entry = json.loads(cached)
+        return {
+            "path": path,
+            "status": "reviewed",
+            "cached": True,
+            "findings": entry["findings"],
+            "recommendations": entry["recommendations"],
+            "scores": [entry["score"]],
+        }
+
+    def _scope_note(self) -> str:
+        if not self.diff_mode:
+            return ""
+        return "\nOnly the regions changed by the diff under review are shown, with a few lines of surrounding context. Report findings about the changed code only.\n"
+
+    def _build_prompt(self, chunks: List[Dict[str, Any]], focus_areas: List[str]) -> str:
+        code = "\n\n".join(render_chunk(chunk) for chunk in chunks)
+        return f"""Review the following code for:
+1. Code quality and best practices
+2. Potential bugs or issues
+3. Security concerns
+4. Performance improvements
+5. Maintainability
+
+Focus areas: {', '.join(focus_areas)}
+{self._scope_note()}
+Each section is headed by its file path and line range, and every line is prefixed with its line number.
+
+Provide the review strictly as a valid JSON object with the following keys: "findings" (list of objects with "file", "line", "severity" (info, low, medium or high) and "description"), "recommendations" (list of strings), and "score" (number between 0 and 10).
+
+Code:
+{code}
+"""
+
+    def _build_batch_prompt(self, chunks: List[Dict[str, Any]], focus_areas: List[str]) -> str:
+        code = "\n\n".join(render_chunk(chunk) for chunk in chunks)
+        return f"""Review each of the following code files for:
+1. Code quality and best practices
+2. Potential bugs or issues
+3. Security concerns
+4. Performance improvements
+5. Maintainability
+
+Focus areas: {', '.join(focus_areas)}
+{self._scope_note()}
+Each section is headed by its file path and line range, and every line is prefixed with its line number.
+
+Provide the review strictly as a valid JSON object with a single key "files": a list with exactly one entry per file path above. Each entry is an object with "path" (exactly as written in its header), "findings" (list of objects with "line", "severity" (info, low, medium or high) and "description"), "recommendations" (list of strings), and "score" (number between 0 and 10).
+
+Code:
+{code}
+"""
+
+    def _prompt_budget(self, instructions: str, limit: int) -> int:
+        """Rendered code tokens per prompt: ``limit``, capped so the prompt and
+        ``max_tokens`` of response fit the model's context window"""
+        available = model_context_tokens(self.openai_model) - self.max_tokens - count_tokens(instructions)
+        # Margin for token estimates and message framing
+        return max(1, min(limit, int(available * 0.95)))
+
+    async def _call_with_retries(self, prompt: str) -> str:
+        """Call OpenAI, retrying failed calls with exponential backoff"""
+        for attempt in range(self.max_retries + 1):
+            try:
+                return await self._call_openai(prompt, json_mode=self.json_mode)
+            except Exception as e:
+                if attempt == self.max_retries:
+                    raise
+                print(f"[CodeReviewAgent] OpenAI call failed (attempt {attempt + 1}): {e}")
+                await asyncio.sleep(REVIEW_RETRY_DELAY * 2 ** attempt)
+
+    async def _get_content(self, project: Any, path: str, ref: str, snapshot: Optional[Dict[str, Any]]) -> str:
+        content = snapshot["contents"].get(path) if snapshot else None
+        if content is None:
+            content = await self.gitlab.get_file_content(project, path, ref)
+        return content
+
+    async def _load_file(self, project: Any, file: Dict[str, Any], ref: str, focus_areas: List[str], snapshot: Optional[Dict[str, Any]], regions: Optional[List[Tuple[int, int]]] = None) -> Dict[str, Any]:
+        """Fetch and chunk one file (or only ``regions`` of it); failures are reported in the result rather than raised.
+
+        A file whose blob was already reviewed with the same focus areas,
+        model and prompt comes back from the review cache instead; with the
+        tree's blob ``id`` at hand its content is not even fetched.
+        """
+        path = file["path"]
+        if file.get("id"):
+            key = self._cache_key(file["id"], focus_areas, regions)
+            cached = self._cached_review(path, key)
+            if cached is not None:
+                return cached
+        else:
+            key = None
+        try:
+            content = await self._get_content(project, path, ref, snapshot)
+        except Exception as e:
+            return {"path": path, "status": "error", "findings": [{
+                "type": "error",
+                "severity": "medium",
+                "description": f"Error reviewing {path}: {str(e)}",
+                "location": path
+            }]}
+        if not is_reviewable_content(content):
+            return {"path": path, "status": "skipped", "findings": []}
+        if key is None:
+            key = self._cache_key(git_blob_sha(content), focus_areas, regions)
+            cached = self._cached_review(path, key)
+            if cached is not None:
+                return cached
+        chunks = chunk_file(path, content, self.chunk_tokens, regions=regions)
+        if not chunks:
+            return {"path": path, "status": "skipped", "findings": []}
+        for chunk in chunks:
+            # Line number prefixes and headers add roughly a tenth
+            chunk["prompt_tokens"] = count_tokens(render_chunk(chunk))
+        findings = []
+        # REVIEW_MAX_CHUNKS_PER_FILE may have cut the file short; say so
+        line_count = len(content.splitlines())
+        last_line = min(regions[-1][1], line_count) if regions else line_count
+        if chunks[-1]["end_line"] < last_line:
+            findings.append({
+                "type": "notice",
+                "severity": "info",
+                "description": f"Only the first {len(chunks)} chunks of {path} were reviewed; lines {chunks[-1]['end_line'] + 1}-{last_line} were not (REVIEW_MAX_CHUNKS_PER_FILE).",
+                "location": f"{path}:{chunks[-1]['end_line'] + 1}-{last_line}",
+                "file": path,
+            })
+        return {"path": path, "status": "pending", "cache_key": key, "chunks": chunks, "findings": findings}
+
+    async def _review_group(self, chunks: List[Dict[str, Any]], focus_areas: List[str]) -> Dict[str, Any]:
+        """Review one prompt's worth of chunks and map its findings back to file/line"""
+        paths = list(dict.fromkeys(chunk["path"] for chunk in chunks))
+        label = ", ".join(paths)
+        try:
+            review = await self._call_with_retries(self._build_prompt(chunks, focus_areas))
+        except Exception as oe:
+            print(f"[ERROR] OpenAI failed for {label}: {oe}")
+            return {"paths": paths, "status": "llm_error", "error": str(oe), "findings": [{
+                "type": "error",
+                "severity": "low",
+                "description": f"OpenAI review failed for {label}: {oe}",
+                "location": label
+            }]}
+
+        try:
+            review_data = parse_review(review)
+        except StructuredOutputError as json_e:
+            print(f"[ERROR] JSON parsing failed for {label}: {json_e}")
+            print(f"[ERROR] Malformed JSON response: {review}")
+            return {"paths": paths, "status": "error", "findings": [{
+                "type": "error",
+                "severity": "low",
+                "description": f"Failed to parse review for {label} due to invalid JSON response from AI.",
+                "location": label
+            }]}
+
+        findings = []
+        for finding in review_data["findings"]:
+            located = locate_finding(finding, chunks)
+            if located["location"] == "N/A":
+                located["location"] = label
+            findings.append(located)
+        return {
+            "paths": paths,
+            "status": "reviewed",
+            "findings": findings,
+            "recommendations": review_data["recommendations"],
+            "score": review_data["score"],
+        }
+
+    async def _review_batch(self, chunks: List[Dict[str, Any]], focus_areas: List[str]) -> List[Dict[str, Any]]:
+        """Review several files in one prompt and split the answer into per-file results.
+
+        Files the response leaves out, or answers with a malformed entry, come
+        back with status "missing" so the caller can ask for them again.
+        """
+        paths = list(dict.fromkeys(chunk["path"] for chunk in chunks))
+        label = ", ".join(paths)
+        try:
+            review = await self._call_with_retries(self._build_batch_prompt(chunks, focus_areas))
+        except Exception as oe:
+            print(f"[ERROR] OpenAI failed for batch {label}: {oe}")
+            return [{"paths": paths, "status": "llm_error", "error": str(oe), "findings": [{
+                "type": "error",
+                "severity": "low",
+                "description": f"OpenAI review failed for {label}: {oe}",
+                "location": label
+            }]}]
+
+        try:
+            entries = parse_batch_review(review)
+        except StructuredOutputError as json_e:
+            print(f"[ERROR] JSON parsing failed for batch {label}: {json_e}")
+            entries = {}
+
+        results = []
+        for path in paths:
+            entry = entries.get(path)
+            if entry is None:
+                results.append({"paths": [path], "status": "missing", "findings": []})
+                continue
+            file_chunks = [chunk for chunk in chunks if chunk["path"] == path]
+            findings = []
+            for finding in entry["findings"]:
+                findings.append(locate_finding({**finding, "file": path}, file_chunks))
+            results.append({
+                "paths": [path],
+                "status": "reviewed",
+                "findings": findings,
+                "recommendations": entry["recommendations"],
+                "score": entry["score"],
+            })
+        return results
+
+    async def _review_batched(self, chunks: List[Dict[str, Any]], focus_areas: List[str], semaphore: asyncio.Semaphore, record) -> List[Dict[str, Any]]:
+        """Review chunks in large batches, re-requesting files a response left out"""
+        results = []
+        pending = chunks
+        for round_number in range(REVIEW_BATCH_RETRY_ROUNDS + 1):
+            async def review(group):
+                async with semaphore:
+                    group_results = await self._review_batch(group, focus_areas)
+                for result in group_results:
+                    record(result)
+                return group_results
+
+            groups = pack_chunks(pending, self._prompt_budget(self._build_batch_prompt([], focus_areas), REVIEW_BATCH_TOKENS), size="prompt_tokens")
+            missing = set()
+            for group_results in await asyncio.gather(*(review(group) for group in groups)):
+                for result in group_results:
+                    if result["status"] == "missing":
+                        missing.update(result["paths"])
+                    else:
+                        results.append(result)
+            pending = [chunk for chunk in pending if chunk["path"] in missing]
+            if not pending:
+                return results
+            print(f"[CodeReviewAgent] Batch responses left out {len(missing)} files (round {round_number + 1})")
+
+        for path in dict.fromkeys(chunk["path"] for chunk in pending):
+            results.append({"paths": [path], "status": "error", "findings": [{
+                "type": "error",
+                "severity": "low",
+                "description": f"Failed to parse review for {path}: the AI response did not include it.",
+                "location": path
+            }]})
+        return results
+
+    async def execute(self, context: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Review repository files concurrently with OpenAI
+
+        Files are split into token-bounded chunks along function/class
+        boundaries, and small files are packed together, so each LLM call
+        covers as much code as its budget allows. In batch mode prompts are
+        much larger and the model answers with one JSON entry per file.
+
+        Args:
+            context: Dictionary containing:
+                - project: GitLab project object
+                - branch: Ref the files are read from
+                - files: Tree entries to review
+                - focus_areas: Review focus areas
+                - snapshot: Optional archive snapshot with file contents
+                - regions: Optional path -> changed line ranges; only those are reviewed
+                - progress: Optional progress callback
+
+        Returns:
+            Dictionary containing findings, recommendations, score and summary
+        """
+        try:
+            project = context["project"]
+            ref = context.get("branch", "main")
+            files = context.get("files", [])
+            focus_areas = context.get("focus_areas") or []
+            snapshot = context.get("snapshot")
+            regions = context.get("regions") or {}
+
+            semaphore = asyncio.Semaphore(max(1, self.concurrency))
+
+            async def load(file):
+                async with semaphore:
+                    return await self._load_file(project, file, ref, focus_areas, snapshot, regions.get(file["path"]))
+
+            loaded = await asyncio.gather(*(load(file) for file in files))
+            files_cached = sum(1 for result in loaded if result.get("cached"))
+            by_path = {result["path"]: result for result in loaded}
+            chunks = [chunk for result in loaded if result["status"] == "pending" for chunk in result["chunks"]]
+            self._report_progress(context, "files_chunked", chunks_total=len(chunks))
+
+            files_reviewed = files_cached
+
+            def record(result):
+                nonlocal files_reviewed
+                if result["status"] != "reviewed":
+                    return
+                for path in result["paths"]:
+                    file = by_path[path]
+                    if result["score"] is None:
+                        file["unscored"] = True
+                    else:
+                        file.setdefault("scores", []).append(result["score"])
+                    if file["status"] != "reviewed":
+                        file["status"] = "reviewed"
+                        files_reviewed += 1
+                        self._report_progress(context, "file_reviewed", files_reviewed=files_reviewed)
+
+            if self.batch:
+                results = await self._review_batched(chunks, focus_areas, semaphore, record)
+            else:
+                async def review(group):
+                    async with semaphore:
+                        result = await self._review_group(group, focus_areas)
+                    record(result)
+                    return result
+
+                # Results keep the input order regardless of completion order
+                budget = self._prompt_budget(self._build_prompt([], focus_areas), self.chunk_tokens)
+                results = await asyncio.gather(*(review(group) for group in pack_chunks(chunks, budget, size="prompt_tokens")))
+
+            findings = [finding for result in loaded for finding in result["findings"]]
+            recommendations = [r for result in loaded if result.get("cached") for r in result["recommendations"]]
+            errors = []
+            incomplete = set()
+            for result in results:
+                findings.extend(result["findings"])
+                if result["status"] == "reviewed":
+                    recommendations.extend(result["recommendations"])
+                else:
+                    incomplete.update(result["paths"])
+                    if result["status"] == "llm_error":
+                        errors.append(result["error"])
+            self._store_reviews(loaded, results, incomplete)
+            # A file's score is the mean over its chunks, each scored 0-10;
+            # files whose responses carried no usable score have none
+            file_scores = {r["path"]: sum(r["scores"]) / len(r["scores"]) for r in loaded if r["status"] == "reviewed" and r.get("scores")}
+            scores = list(file_scores.values())
+            files_reviewed = sum(1 for result in loaded if result["status"] == "reviewed")
+            files_skipped = sum(1 for result in loaded if result["status"] == "skipped")
+            print(f"[DEBUG] Finished reviewing files. Files reviewed: {files_reviewed} ({files_cached} from cache)")
+
+            if files_reviewed == 0:
+                return self._format_success("No files could be reviewed", {
+                    "files_reviewed": 0,
+                    "files_cached": 0,
+                    "files_skipped": files_skipped,
+                    "files_failed": len(files) - files_skipped,
+                    "findings": findings,
+                    "recommendations": [],
+                    "score": 0,
+                    "file_scores": {},
+                    "summary": None,
+                    "openai_error": errors[0] if errors else None
+                })
+
+            score = min(max(sum(scores) / len(scores), 0), 10) if scores else None
+            summary = await self._summarize(findings, recommendations)
+            return self._format_success("Code review completed", {
+                "files_reviewed": files_reviewed,
+                "files_cached": files_cached,
+                "files_skipped": files_skipped,
+                "files_failed": len(files) - files_reviewed - files_skipped,
+                "findings": findings,
+                "recommendations": recommendations,
+                "score": score,
+                "file_scores": file_scores,
+                "summary": summary,
+                "openai_error": errors[0] if errors else None
+            })
+        except Exception as e:
+            return self._format_error(e)
+
+    def _store_reviews(self, loaded: List[Dict[str, Any]], results: List[Dict[str, Any]], incomplete: set):
+        """Cache the review of every file whose prompts all succeeded with a score"""
+        reviews = {}
+        for result in results:
+            if result["status"] != "reviewed":
+                continue
+            for finding in result["findings"]:
+                if finding.get("file") in result["paths"]:
+                    reviews.setdefault(finding["file"], {"findings": [], "recommendations": []})["findings"].append(finding)
+            # Recommendations of a packed prompt are not per file; keep them with its first file
+            reviews.setdefault(result["paths"][0], {"findings": [], "recommendations": []})["recommendations"].extend(result["recommendations"])
+        for file in loaded:
+            if file["status"] != "reviewed" or file.get("cached") or file.get("unscored") or file["path"] in incomplete:
+                continue
+            review = reviews.get(file["path"], {"findings": [], "recommendations": []})
+            review["findings"] = file["findings"] + review["findings"]
+            review["score"] = sum(file["scores"]) / len(file["scores"])
+            try:
+                review_cache.put(file["cache_key"], json.dumps(review))
+            except Exception as e:
+                print(f"[CodeReviewAgent] Could not cache review of {file['path']}: {e}")
+
+    async def resolve_diff(self, project: Any, merge_request_iid: Optional[int] = None, base: Optional[str] = None, head: Optional[str] = None) -> Dict[str, Any]:
+        """Resolve a merge request or base...head range to the files and line regions it changed.
+
+        Returns ``base_sha``, ``head_sha``, the changed blobs as tree entries,
+        and ``regions``: path -> line ranges (with context) to review, or None
+        when GitLab sent no diff text for a file and it must be reviewed whole.
+        """
+        if merge_request_iid is not None:
+            refs = await self.gitlab.merge_request_refs(project, merge_request_iid)
+            base_sha, head_sha = refs["base_sha"], refs["head_sha"]
+        else:
+            base_sha = await self.gitlab.resolve_ref(project, base)
+            head_sha = await self.gitlab.resolve_ref(project, head)
+        # A merge request's base_sha already is the merge base; for a range,
+        # diff from the merge base so changes made only on base are left out
+        comparison = await self.gitlab.compare(project, base_sha, head_sha, straight=merge_request_iid is not None)
+        files, regions = [], {}
+        for diff in comparison.get("diffs", []):
+            if diff.get("deleted_file"):
+                continue
+            text = diff.get("diff") or ""
+            if not text and not (diff.get("too_large") or diff.get("collapsed")):
+                # Pure renames and mode changes carry no text: nothing to review
+                if diff.get("renamed_file") or diff.get("a_mode") != diff.get("b_mode"):
+                    continue
+            path = diff["new_path"]
+            files.append({"path": path, "type": "blob"})
+            # Oversized diffs come back without text
+            changed = changed_line_ranges(text)
+            regions[path] = expand_ranges(changed) if changed else None
+        return {"base_sha": base_sha, "head_sha": head_sha, "files": files, "regions": regions}
+
+    def review_settings(self, focus_areas: List[str]) -> Dict[str, Any]:
+        """What a review's results depend on besides the code; stored with each review"""
+        return {
+            "focus_areas": sorted(focus_areas or []),
+            "model": self.openai_model,
+            "prompt_version": REVIEW_PROMPT_VERSION,
+            "scope": "diff" if self.diff_mode else "full",
+            "prompt": "batch" if self.batch else "single",
+        }
+
+    async def reusable_results(self, project: Any, previous: Optional[Dict[str, Any]], head_sha: str, paths: List[str], focus_areas: List[str]) -> Dict[str, Dict[str, Any]]:
+        """Findings and scores from a previous review for files unchanged since it ran.
+
+        Only a whole-file review with the same focus areas, model and prompts
+        qualifies; a diff review's scores cover just the changed regions.
+        """
+        if not previous or not previous.get("commit_sha") or not previous.get("file_scores"):
+            return {}
+        if previous.get("review_settings") != {**self.review_settings(focus_areas), "scope": "full"}:
+            return {}
+        if previous["commit_sha"] == head_sha:
+            changed = set()
+        else:
+            comparison = await self.gitlab.compare(project, previous["commit_sha"], head_sha)
+            changed = {d["new_path"] for d in comparison.get("diffs", [])} | {d["old_path"] for d in comparison.get("diffs", [])}
+        reusable = {}
+        for path in paths:
+            if path in changed or path not in previous["file_scores"]:
+                continue
+            reusable[path] = {
+                "score": previous["file_scores"][path],
+                "findings": [f for f in previous.get("findings", []) if f.get("file") == path],
+            }
+        return reusable
+
+    async def _summarize(self, findings: List[Dict[str, Any]], recommendations: List[Any]) -> str:
+        if not findings and not recommendations:
+            return "No significant issues found in the reviewed files."
+        summary_prompt = f"""Based on these findings and recommendations, provide a summary of the most important improvements needed:\n{self._condense(findings, recommendations)}\n\nReturn a brief summary paragraph."""
+        try:
+            return await self._call_openai(summary_prompt)
+        except Exception as oe:
+            return f"OpenAI summary failed: {oe}."
+
+    def _condense(self, findings: List[Dict[str, Any]], recommendations: List[Any]) -> str:
+        """Findings (most severe first) and distinct recommendations, cut to REVIEW_SUMMARY_TOKENS"""
+        ranked = sorted(findings, key=lambda f: SEVERITY_RANK.get(str(f.get("severity", "")).lower(), len(SEVERITY_RANK)))
+        lines = ["Findings:"]
+        # A quarter of the budget is kept for recommendations
+        budget = REVIEW_SUMMARY_TOKENS * 3 // 4
+        omitted = 0
+        for finding in ranked:
+            line = f"- [{finding.get('severity', 'info')}] {finding.get('location', 'N/A')}: {finding.get('description', '')}"
+            cost = count_tokens(line)
+            if cost > budget:
+                omitted += 1
+                continue
+            lines.append(line)
+            budget -= cost
+        if omitted:
+            lines.append(f"- ... and {omitted} more findings")
+        lines.append("Recommendations:")
+        budget += REVIEW_SUMMARY_TOKENS - REVIEW_SUMMARY_TOKENS * 3 // 4
+        for recommendation in dict.fromkeys(str(r) for r in recommendations):
+            line = f"- {recommendation}"
+            cost = count_tokens(line)
+            if cost > budget:
+                break
+            lines.append(line)
+            budget -= cost
+        return "\n".join(lines)
@@ -1,12 +1,12 @@
 from typing import Any, Dict
-import gitlab
 from .base_agent import BaseAgent
+from .gitlab_client import AsyncGitLab, create_gitlab_client
 import os
 from google.cloud import run_v2, artifactregistry_v1
 from google.cloud.run_v2 import Service
 
 class DeploymentAgent(BaseAgent):
-    def __init__(self):
+    def __init__(self, gitlab_client: AsyncGitLab = None):
         """Initialize the DeploymentAgent with GitLab and Google Cloud configuration"""
         super().__init__()
         self.gitlab_url = os.getenv("GITLAB_URL")
@@ -18,7 +18,9 @@ class DeploymentAgent(BaseAgent):
         if not self.project_id:
             raise ValueError("Google Cloud project ID is missing")
             
-        self.gl = gitlab.Gitlab(self.gitlab_url, private_token=self.gitlab_token)
+        # Prefer the shared, pooled client; build a private one otherwise
+        self.gitlab = gitlab_client or create_gitlab_client(self.gitlab_url, self.gitlab_token)
+        self.gl = self.gitlab.gl
         self.run_client = run_v2.ServicesClient()
         self.artifact_client = artifactregistry_v1.ArtifactRegistryClient()
     
@@ -45,7 +47,7 @@ class DeploymentAgent(BaseAgent):
             
             # Get project
             project_path = self._extract_project_path(repo_url)
-            project = self.gl.projects.get(project_path)
+            project = await self.gitlab.get_project(project_path)
             
             # Deploy pipeline to GitLab
             pipeline_result = await self._deploy_pipeline(project, pipeline_yaml)
@@ -77,11 +79,11 @@ class DeploymentAgent(BaseAgent):
         try:
             # Create or update .gitlab-ci.yml
             try:
-                file = project.files.get(".gitlab-ci.yml", "main")
+                file = await self.gitlab.get_file(project, ".gitlab-ci.yml", "main")
                 file.content = pipeline_yaml
-                file.save(branch="main", commit_message="Update CI/CD pipeline")
+                await self.gitlab.run(file.save, branch="main", commit_message="Update CI/CD pipeline")
             except:
-                project.files.create({
+                await self.gitlab.run(project.files.create, {
                     'file_path': '.gitlab-ci.yml',
                     'branch': 'main',
                     'content': pipeline_yaml,
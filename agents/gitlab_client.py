@@ -0,0 +1,146 @@
+from typing import Any, AsyncIterator, Callable, Dict, List
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+import asyncio
+import itertools
+import os
+import tarfile
+import gitlab
+import requests
+from requests.adapters import HTTPAdapter
+
+# python-gitlab is synchronous. All calls go through one bounded pool so a
+# slow GitLab can tie up at most GITLAB_MAX_WORKERS threads, never the event loop.
+GITLAB_MAX_WORKERS = int(os.getenv("GITLAB_MAX_WORKERS", "16"))
+_executor = ThreadPoolExecutor(max_workers=GITLAB_MAX_WORKERS, thread_name_prefix="gitlab")
+
+# Keep-alive connections held open to GitLab, and per-request timeout (seconds).
+GITLAB_POOL_SIZE = int(os.getenv("GITLAB_POOL_SIZE", str(GITLAB_MAX_WORKERS)))
+GITLAB_TIMEOUT = float(os.getenv("GITLAB_TIMEOUT", "30"))
+
+# GitLab caps per_page at 100 for the tree endpoint.
+TREE_PAGE_SIZE = 100
+
+
+def create_gitlab_client(url: str = None, token: str = None) -> "AsyncGitLab":
+    """Create a GitLab client backed by a pooled keep-alive HTTP session"""
+    url = url or os.getenv("GITLAB_URL")
+    token = token or os.getenv("GITLAB_TOKEN")
+    if not url or not token:
+        raise ValueError("GitLab configuration is missing")
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=GITLAB_POOL_SIZE)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    gl = gitlab.Gitlab(url, private_token=token, session=session, timeout=GITLAB_TIMEOUT)
+    return AsyncGitLab(gl)
+
+
+class AsyncGitLab:
+    """Awaitable facade over a python-gitlab client"""
+
+    def __init__(self, gl: gitlab.Gitlab):
+        self.gl = gl
+
+    async def run(self, func: Callable, *args: Any, **kwargs: Any) -> Any:
+        """Run a blocking python-gitlab call on the GitLab thread pool"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_executor, partial(func, *args, **kwargs))
+
+    def close(self):
+        """Close the pooled HTTP connections"""
+        self.gl.session.close()
+
+    async def get_project(self, project_path: str) -> Any:
+        return await self.run(self.gl.projects.get, project_path)
+
+    async def resolve_ref(self, project: Any, ref: str) -> str:
+        """Return the commit SHA a branch, tag or SHA currently points to"""
+        commit = await self.run(project.commits.get, ref)
+        return commit.id
+
+    async def compare(self, project: Any, from_sha: str, to_sha: str, straight: bool = True) -> Dict[str, Any]:
+        """Return the diff between two commits.
+
+        ``straight`` diffs ``from_sha`` directly against ``to_sha``; otherwise
+        the diff starts from their merge base, like git's ``from...to``.
+        """
+        return await self.run(project.repository_compare, from_sha, to_sha, straight="true" if straight else "false")
+
+    async def merge_request_refs(self, project: Any, iid: int) -> Dict[str, str]:
+        """Return a merge request's ``base_sha``, ``start_sha`` and ``head_sha``"""
+        merge_request = await self.run(project.mergerequests.get, iid)
+        return merge_request.diff_refs
+
+    async def recent_changes(self, project: Any, ref: str, limit: int) -> List[Dict[str, Any]]:
+        """Return the last ``limit`` commits on ``ref``, newest first, with the paths each changed.
+
+        Only the first page of each commit's diff is read; that is plenty to
+        tell which files change often.
+        """
+        commits = await self.run(project.commits.list, ref_name=ref, per_page=limit, get_all=False)
+
+        async def changes(commit):
+            diff = await self.run(commit.diff, per_page=TREE_PAGE_SIZE, get_all=False)
+            return {
+                "id": commit.id,
+                "committed_date": getattr(commit, "committed_date", None),
+                "paths": [d["new_path"] for d in diff if not d.get("deleted_file")],
+            }
+
+        return list(await asyncio.gather(*(changes(commit) for commit in commits[:limit])))
+
+    async def iter_repository_tree(
+        self, project: Any, ref: str, recursive: bool = True, per_page: int = TREE_PAGE_SIZE
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """Yield every tree entry, fetching one page at a time.
+
+        Uses keyset pagination so deep pages stay cheap on large repositories.
+        Only the current page is held in memory, and breaking out of the loop
+        stops further requests.
+        """
+        pages = await self.run(
+            project.repository_tree,
+            ref=ref,
+            recursive=recursive,
+            per_page=per_page,
+            pagination="keyset",
+            iterator=True,
+        )
+        while True:
+            # Draining one page's worth of entries triggers at most one request.
+            batch = await self.run(lambda: list(itertools.islice(pages, per_page)))
+            if not batch:
+                return
+            for entry in batch:
+                yield entry
+
+    async def read_archive(self, project: Any, ref: str, reader: Callable[[Any], Any]) -> Any:
+        """Stream the tar.gz archive of ``ref`` into ``reader``.
+
+        ``reader`` runs on the GitLab thread pool and receives an open
+        streaming ``tarfile`` object; the archive is decompressed as it
+        downloads and never written to disk. Returns whatever ``reader`` returns.
+        """
+        def download():
+            response = self.gl.http_request(
+                "get",
+                f"/projects/{project.id}/repository/archive.tar.gz",
+                query_data={"sha": ref},
+                streamed=True,
+            )
+            try:
+                response.raw.decode_content = True
+                with tarfile.open(fileobj=response.raw, mode="r|gz") as archive:
+                    return reader(archive)
+            finally:
+                response.close()
+
+        return await self.run(download)
+
+    async def get_file(self, project: Any, file_path: str, ref: str) -> Any:
+        return await self.run(project.files.get, file_path, ref)
+
+    async def get_file_content(self, project: Any, file_path: str, ref: str) -> str:
+        """Fetch a file and return its decoded text content"""
+        return await self.run(lambda: project.files.get(file_path, ref).decode().decode())
@@ -0,0 +1,140 @@
+from typing import Any, Dict, Optional
+from threading import Lock
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import time
+
+# SQLite file holding cached LLM responses (empty disables the cache), and
+# the total size of stored responses before least recently used ones are evicted.
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", "llm_cache.db")
+LLM_CACHE_MAX_BYTES = int(os.getenv("LLM_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+
+
+class DiskCache:
+    """Size-bounded LRU cache of text values persisted in SQLite.
+
+    Each entry records its size and last use; once the stored values exceed
+    ``max_bytes`` the least recently used entries are deleted.
+    """
+
+    def __init__(self, path: Optional[str], max_bytes: int, table: str = "entries"):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.table = table
+        self._lock = Lock()
+        self._db = None
+        self._size = 0
+        self._count = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        if path and max_bytes > 0:
+            self._open()
+
+    def _open(self):
+        self._db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            f"CREATE TABLE IF NOT EXISTS {self.table} "
+            "(key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, used_at REAL NOT NULL)"
+        )
+        self._db.execute(f"CREATE INDEX IF NOT EXISTS {self.table}_used_at ON {self.table} (used_at)")
+        self._sync_totals()
+        self._evict()
+
+    @property
+    def enabled(self) -> bool:
+        return self._db is not None
+
+    def get(self, key: str) -> Optional[str]:
+        if self._db is None:
+            return None
+        with self._lock:
+            row = self._db.execute(f"SELECT value FROM {self.table} WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._db.execute(f"UPDATE {self.table} SET used_at = ? WHERE key = ?", (time.time(), key))
+            return row[0]
+
+    def put(self, key: str, value: str):
+        if self._db is None:
+            return
+        size = len(value.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._db.execute(f"SELECT size FROM {self.table} WHERE key = ?", (key,)).fetchone()
+            self._db.execute(
+                f"INSERT OR REPLACE INTO {self.table} (key, value, size, used_at) VALUES (?, ?, ?, ?)",
+                (key, value, size, time.time()),
+            )
+            if old is None:
+                self._count += 1
+            self._size += size - (old[0] if old else 0)
+            self._evict()
+
+    def _sync_totals(self):
+        """Re-read entry count and size; other processes may share the file"""
+        self._count, size = self._db.execute(f"SELECT COUNT(*), SUM(size) FROM {self.table}").fetchone()
+        self._size = size or 0
+
+    def _evict(self):
+        if self._size <= self.max_bytes:
+            return
+        self._sync_totals()
+        while self._size > self.max_bytes and self._count:
+            rows = self._db.execute(
+                f"SELECT key, size FROM {self.table} ORDER BY used_at LIMIT 100"
+            ).fetchall()
+            if not rows:
+                # Another process emptied the table under us
+                self._sync_totals()
+                break
+            evicted = []
+            for key, size in rows:
+                if self._size <= self.max_bytes:
+                    break
+                evicted.append((key,))
+                self._size -= size
+                self._count -= 1
+            self._db.executemany(f"DELETE FROM {self.table} WHERE key = ?", evicted)
+            self.evictions += len(evicted)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": self._db is not None,
+                "entries": self._count,
+                "size_bytes": self._size,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+def normalize_prompt(prompt: Optional[str]) -> str:
+    """Canonical form of a prompt: unified newlines, no trailing whitespace, no outer blank lines"""
+    if not prompt:
+        return ""
+    lines = prompt.replace("\r\n", "\n").replace("\r", "\n").split("\n")
+    return re.sub(r"\n{3,}", "\n\n", "\n".join(line.rstrip() for line in lines)).strip()
+
+
+def llm_cache_key(model: str, system_prompt: Optional[str], prompt: str, temperature: float, json_mode: bool = False) -> str:
+    key = [model, normalize_prompt(system_prompt), normalize_prompt(prompt), round(float(temperature), 3)]
+    if json_mode:
+        # Only appended when set, so keys of plain-text requests stay unchanged
+        key.append("json_object")
+    payload = json.dumps(key)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+llm_cache = DiskCache(LLM_CACHE_PATH, LLM_CACHE_MAX_BYTES, table="llm_responses")
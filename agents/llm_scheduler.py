@@ -0,0 +1,200 @@
+from typing import Any, Awaitable, Callable, Dict, Optional
+from collections import OrderedDict, deque
+import asyncio
+import os
+import time
+
+# Provider limits shared by every agent and request in this process.
+OPENAI_REQUESTS_PER_MINUTE = float(os.getenv("OPENAI_REQUESTS_PER_MINUTE", "60"))
+OPENAI_TOKENS_PER_MINUTE = float(os.getenv("OPENAI_TOKENS_PER_MINUTE", "90000"))
+# Requests allowed in flight at once, across all agents in this process.
+LLM_MAX_IN_FLIGHT = int(os.getenv("LLM_MAX_IN_FLIGHT", "4"))
+
+# Priority classes; lower values are served first.
+INTERACTIVE = 0
+BATCH = 1
+PRIORITY_NAMES = {INTERACTIVE: "interactive", BATCH: "batch"}
+
+
+def estimate_tokens(*texts: Optional[str]) -> int:
+    """Rough token count (~4 characters per token) used for rate limiting"""
+    return sum(len(text) for text in texts if text) // 4 + 1
+
+
+class TokenBucket:
+    """Token bucket refilled continuously at ``rate_per_minute``"""
+
+    def __init__(self, rate_per_minute: float, capacity: Optional[float] = None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity if capacity is not None else rate_per_minute
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """Seconds until ``amount`` tokens are available"""
+        self._refill()
+        # A request larger than the bucket only has to wait for a full bucket
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def consume(self, amount: float):
+        self._refill()
+        self.tokens -= min(amount, self.capacity)
+
+
+class LLMScheduler:
+    """Process-wide queue in front of the LLM provider.
+
+    Requests are admitted against request-per-minute and token-per-minute
+    buckets, with at most ``max_in_flight`` running at once. Interactive work
+    always goes ahead of batch work, and within a priority class clients are
+    served round-robin so one large job cannot starve everyone else.
+
+    A single dispatcher task sleeps until work is submitted, a running
+    request finishes or the buckets refill; it never polls.
+    """
+
+    def __init__(self, requests_per_minute: float, tokens_per_minute: float, max_in_flight: int = 1):
+        self.request_bucket = TokenBucket(requests_per_minute)
+        self.token_bucket = TokenBucket(tokens_per_minute)
+        self.max_in_flight = max(1, max_in_flight)
+        # priority -> client_id -> deque of jobs
+        self._queues: Dict[int, "OrderedDict[str, deque]"] = {INTERACTIVE: OrderedDict(), BATCH: OrderedDict()}
+        self._wakeup = None
+        self._dispatcher = None
+        self._running = set()
+        self._in_flight = 0
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.total_wait_seconds = 0.0
+
+    def _ensure_dispatcher(self):
+        if self._dispatcher is None or self._dispatcher.done():
+            self._wakeup = asyncio.Event()
+            self._dispatcher = asyncio.create_task(self._dispatch())
+
+    async def submit(
+        self,
+        func: Callable[[], Awaitable[Any]],
+        priority: int = INTERACTIVE,
+        client_id: str = "default",
+        tokens: int = 0,
+    ) -> Any:
+        """Queue ``func`` and return its result once the limits allow it to run"""
+        self._ensure_dispatcher()
+        future = asyncio.get_running_loop().create_future()
+        queue = self._queues[priority].setdefault(client_id, deque())
+        queue.append((func, tokens, future, time.monotonic()))
+        self.submitted += 1
+        self._wakeup.set()
+        return await future
+
+    def _peek(self):
+        for priority in sorted(self._queues):
+            clients = self._queues[priority]
+            if clients:
+                client_id, queue = next(iter(clients.items()))
+                return priority, client_id, queue[0]
+        return None
+
+    def _pop(self, priority: int, client_id: str):
+        clients = self._queues[priority]
+        queue = clients[client_id]
+        job = queue.popleft()
+        # Rotate the client to the back so the next client gets a turn
+        del clients[client_id]
+        if queue:
+            clients[client_id] = queue
+        return job
+
+    async def _dispatch(self):
+        while True:
+            head = self._peek()
+            if head is None or self._in_flight >= self.max_in_flight:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            priority, client_id, (func, tokens, future, enqueued) = head
+            wait = max(self.request_bucket.wait_time(1), self.token_bucket.wait_time(tokens))
+            if wait > 0:
+                # Re-evaluate early if higher-priority work arrives meanwhile
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            self._pop(priority, client_id)
+            if future.cancelled():
+                continue
+            self.request_bucket.consume(1)
+            self.token_bucket.consume(tokens)
+            self.total_wait_seconds += time.monotonic() - enqueued
+            self._in_flight += 1
+            task = asyncio.create_task(self._run(func, future))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+            # A caller that gives up cancels the request it was waiting on
+            future.add_done_callback(lambda f, task=task: task.cancel() if f.cancelled() else None)
+
+    async def _run(self, func: Callable[[], Awaitable[Any]], future: asyncio.Future):
+        try:
+            result = await func()
+        except asyncio.CancelledError:
+            if not future.done():
+                future.cancel()
+        except Exception as e:
+            self.failed += 1
+            if not future.done():
+                future.set_exception(e)
+        else:
+            self.completed += 1
+            if not future.done():
+                future.set_result(result)
+        finally:
+            self._in_flight -= 1
+            self._wakeup.set()
+
+    async def shutdown(self):
+        """Stop the dispatcher, cancel running requests and fail queued ones"""
+        tasks = list(self._running)
+        if self._dispatcher is not None:
+            tasks.append(self._dispatcher)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        for clients in self._queues.values():
+            for queue in clients.values():
+                for _, _, future, _ in queue:
+                    future.cancel()
+            clients.clear()
+        self._dispatcher = None
+
+    def stats(self) -> Dict[str, Any]:
+        started = self.completed + self.failed
+        return {
+            "queue_depth": {
+                PRIORITY_NAMES[priority]: sum(len(queue) for queue in clients.values())
+                for priority, clients in self._queues.items()
+            },
+            "queued_clients": sum(len(clients) for clients in self._queues.values()),
+            "in_flight": self._in_flight,
+            "max_in_flight": self.max_in_flight,
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "failed": self.failed,
+            "average_wait_seconds": self.total_wait_seconds / started if started else 0.0,
+            "available_requests": round(self.request_bucket.tokens, 2),
+            "available_tokens": round(self.token_bucket.tokens),
+        }
+
+
+llm_scheduler = LLMScheduler(OPENAI_REQUESTS_PER_MINUTE, OPENAI_TOKENS_PER_MINUTE, LLM_MAX_IN_FLIGHT)
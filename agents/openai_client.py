@@ -0,0 +1,63 @@
+from typing import Optional
+import os
+import httpx
+from openai import AsyncOpenAI
+
+# Connections kept to the OpenAI API by the shared client, and request timeout.
+OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", "100"))
+OPENAI_TIMEOUT = float(os.getenv("OPENAI_TIMEOUT", "120"))
+# Ask for JSON-mode responses (response_format json_object) where a JSON answer is expected.
+OPENAI_JSON_MODE = os.getenv("OPENAI_JSON_MODE", "false").lower() in ("1", "true", "yes")
+
+# Context window (prompt plus response tokens) of the configured model.
+# OPENAI_CONTEXT_TOKENS overrides the lookup, e.g. for fine-tuned models.
+OPENAI_CONTEXT_TOKENS = int(os.getenv("OPENAI_CONTEXT_TOKENS", "0"))
+MODEL_CONTEXT_TOKENS = {
+    "gpt-3.5-turbo": 16385,
+    "gpt-4": 8192,
+    "gpt-4-32k": 32768,
+    "gpt-4-turbo": 128000,
+    "gpt-4-1106": 128000,
+    "gpt-4-0125": 128000,
+    "gpt-4o": 128000,
+    "gpt-4.1": 1047576,
+    "o1": 200000,
+    "o3": 200000,
+    "o4": 200000,
+}
+DEFAULT_CONTEXT_TOKENS = 16385
+
+_client: Optional[AsyncOpenAI] = None
+
+
+def model_context_tokens(model: str) -> int:
+    """Context window of ``model``, matched on the longest known name prefix"""
+    if OPENAI_CONTEXT_TOKENS > 0:
+        return OPENAI_CONTEXT_TOKENS
+    matches = [name for name in MODEL_CONTEXT_TOKENS if model.startswith(name)]
+    return MODEL_CONTEXT_TOKENS[max(matches, key=len)] if matches else DEFAULT_CONTEXT_TOKENS
+
+
+def get_openai_client() -> AsyncOpenAI:
+    """Return the process-wide async OpenAI client, creating it on first use"""
+    global _client
+    if _client is None:
+        _client = AsyncOpenAI(
+            api_key=os.getenv("OPENAI_API_KEY"),
+            timeout=OPENAI_TIMEOUT,
+            http_client=httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=OPENAI_MAX_CONNECTIONS,
+                    max_keepalive_connections=OPENAI_MAX_CONNECTIONS,
+                ),
+                timeout=OPENAI_TIMEOUT,
+            ),
+        )
+    return _client
+
+
+async def close_openai_client():
+    global _client
+    if _client is not None:
+        await _client.close()
+        _client = None
@@ -0,0 +1,247 @@
+from typing import Any, Dict, List, Optional, Tuple
+import os
+import re
+from .llm_scheduler import estimate_tokens
+
+try:
+    import tiktoken
+except ImportError:  # optional; fall back to the ~4 characters per token estimate
+    tiktoken = None
+
+# Code tokens per review prompt. Large files are split into chunks of at most
+# this size; small files are packed together until a prompt reaches it.
+REVIEW_CHUNK_TOKENS = int(os.getenv("REVIEW_CHUNK_TOKENS", "3000"))
+# Chunks reviewed per file at most, so one huge file cannot eat the budget.
+REVIEW_MAX_CHUNKS_PER_FILE = int(os.getenv("REVIEW_MAX_CHUNKS_PER_FILE", "8"))
+# Lines of unchanged code shown around each changed region in diff reviews.
+REVIEW_DIFF_CONTEXT_LINES = int(os.getenv("REVIEW_DIFF_CONTEXT_LINES", "10"))
+
+# Lines that start a function, class or similar top-level unit in common languages
+DEFINITION_PATTERN = re.compile(
+    r"^\s*(?:(?:export|public|private|protected|internal|static|abstract|final|override|open|sealed|data|inline|suspend|"
+    r"operator|infix|tailrec|virtual|partial|pub(?:\([a-z]+\))?|async|default)\s+)*"
+    r"(?:def|class|function|func|fun|fn|impl|trait|struct|enum|interface|module|namespace|object|sub)\b"
+)
+# C-family (Java, C#, C, C++) functions and methods, which have no keyword:
+# a return type and modifiers, then the name and an opening parenthesis.
+# Control statements, calls and declarations ending in ";" are excluded.
+C_FAMILY_METHOD_PATTERN = re.compile(
+    r"^\s*(?!(?:if|else|for|foreach|while|switch|return|new|throw|catch|do|case|goto|using|lock|delete|sizeof|yield|await)\b)"
+    r"(?:[\w$<>\[\],.?:]+[*&]*\s+)+[*&]*[\w$~:]+\s*\((?!.*;\s*$)"
+)
+C_FAMILY_EXTENSIONS = {"java", "c", "h", "cc", "cpp", "cxx", "hh", "hpp", "hxx", "cs", "dart", "groovy"}
+# Decorators, annotations and comments that belong to the definition below them
+PREAMBLE_PATTERN = re.compile(r"^\s*(?:@|#|//|/\*|\*|--|\"\"\"|''')")
+# Unified diff hunk header; captures the first line number in the new file
+HUNK_HEADER = re.compile(r"^@@ -\d+(?:,\d+)? \+(\d+)(?:,\d+)? @@")
+
+_encoding = None
+
+
+def count_tokens(text: str) -> int:
+    """Number of tokens in ``text``, exact when tiktoken is installed"""
+    global _encoding
+    if tiktoken is not None:
+        if _encoding is None:
+            _encoding = tiktoken.get_encoding("cl100k_base")
+        return len(_encoding.encode(text, disallowed_special=()))
+    return estimate_tokens(text)
+
+
+def _patterns(path: str) -> List[re.Pattern]:
+    name = path.rsplit("/", 1)[-1]
+    extension = name.rsplit(".", 1)[-1].lower() if "." in name else ""
+    if extension in C_FAMILY_EXTENSIONS:
+        return [DEFINITION_PATTERN, C_FAMILY_METHOD_PATTERN]
+    return [DEFINITION_PATTERN]
+
+
+def _boundaries(lines: List[str], top_level: bool, patterns: List[re.Pattern]) -> List[int]:
+    """Indices where a new definition (with its leading decorators/comments) starts"""
+    starts = []
+    for index, line in enumerate(lines):
+        if not any(pattern.match(line) for pattern in patterns):
+            continue
+        if top_level and line[:1].isspace():
+            continue
+        start = index
+        while start > 0 and PREAMBLE_PATTERN.match(lines[start - 1]):
+            start -= 1
+        if not starts or start > starts[-1]:
+            starts.append(start)
+    if not starts or starts[0] != 0:
+        starts.insert(0, 0)
+    return starts
+
+
+def _segments(lines: List[str], first_line: int, max_tokens: int, patterns: List[re.Pattern], top_level: bool = True) -> List[Dict[str, Any]]:
+    """Split ``lines`` into segments of at most ``max_tokens`` along definition boundaries"""
+    starts = _boundaries(lines, top_level, patterns) + [len(lines)]
+    segments = []
+    for start, end in zip(starts, starts[1:]):
+        text = "\n".join(lines[start:end])
+        tokens = count_tokens(text)
+        if tokens <= max_tokens:
+            segments.append({"start": first_line + start, "end": first_line + end - 1, "text": text, "tokens": tokens})
+        elif top_level:
+            # A large class (or function): split it again at its methods
+            segments.extend(_segments(lines[start:end], first_line + start, max_tokens, patterns, top_level=False))
+        else:
+            segments.extend(_split_lines(lines[start:end], first_line + start, max_tokens))
+    return segments
+
+
+def _split_lines(lines: List[str], first_line: int, max_tokens: int) -> List[Dict[str, Any]]:
+    """Last resort: cut a block with no usable boundaries into line ranges"""
+    segments, current, tokens = [], [], 0
+    start = first_line
+    for offset, line in enumerate(lines):
+        line_tokens = count_tokens(line) + 1
+        if current and tokens + line_tokens > max_tokens:
+            segments.append({"start": start, "end": first_line + offset - 1, "text": "\n".join(current), "tokens": tokens})
+            current, tokens, start = [], 0, first_line + offset
+        current.append(line)
+        tokens += line_tokens
+    if current:
+        segments.append({"start": start, "end": first_line + len(lines) - 1, "text": "\n".join(current), "tokens": tokens})
+    return segments
+
+
+def chunk_file(
+    path: str,
+    content: str,
+    max_tokens: int = REVIEW_CHUNK_TOKENS,
+    max_chunks: int = REVIEW_MAX_CHUNKS_PER_FILE,
+    regions: Optional[List[Tuple[int, int]]] = None,
+) -> List[Dict[str, Any]]:
+    """Split a file into chunks of at most ``max_tokens`` tokens.
+
+    Adjacent definitions are merged while they fit, so a small file stays a
+    single chunk. Each chunk carries its 1-based ``start_line``/``end_line``.
+    With ``regions`` (inclusive 1-based line ranges) only those lines are
+    chunked, each region separately.
+    """
+    lines = content.splitlines()
+    if not lines:
+        return []
+    if regions is None:
+        regions = [(1, len(lines))]
+    patterns = _patterns(path)
+    segments = []
+    for start, end in regions:
+        end = min(end, len(lines))
+        if start <= end:
+            segments.append(_segments(lines[start - 1:end], start, max_tokens, patterns))
+    chunks = []
+    for segment in (segment for region in segments for segment in region):
+        # Only merge with the previous chunk when the lines are contiguous
+        if chunks and chunks[-1]["end_line"] + 1 == segment["start"] and chunks[-1]["tokens"] + segment["tokens"] <= max_tokens:
+            last = chunks[-1]
+            last["text"] += "\n" + segment["text"]
+            last["end_line"] = segment["end"]
+            last["tokens"] += segment["tokens"]
+            continue
+        if len(chunks) == max_chunks:
+            print(f"[ReviewChunking] {path}: reviewing {max_chunks} chunks, skipping from line {segment['start']}")
+            break
+        chunks.append({
+            "path": path,
+            "start_line": segment["start"],
+            "end_line": segment["end"],
+            "text": segment["text"],
+            "tokens": segment["tokens"],
+        })
+    return chunks
+
+
+def changed_line_ranges(diff: str) -> List[Tuple[int, int]]:
+    """Line ranges of the new file touched by a unified diff.
+
+    Added lines form ranges; a pure deletion marks the line that follows it.
+    """
+    ranges = []
+    line = 0
+    for text in diff.splitlines():
+        header = HUNK_HEADER.match(text)
+        if header:
+            line = int(header.group(1))
+            continue
+        if not line or text.startswith("\\"):
+            continue
+        if text.startswith("+"):
+            changed = line
+            line += 1
+        elif text.startswith("-"):
+            changed = max(line, 1)
+        else:
+            line += 1
+            continue
+        if ranges and ranges[-1][1] >= changed - 1:
+            ranges[-1] = (ranges[-1][0], max(ranges[-1][1], changed))
+        else:
+            ranges.append((changed, changed))
+    return ranges
+
+
+def expand_ranges(ranges: List[Tuple[int, int]], context: int = REVIEW_DIFF_CONTEXT_LINES) -> List[Tuple[int, int]]:
+    """Widen ranges by ``context`` lines on each side and merge overlaps"""
+    merged = []
+    for start, end in sorted(ranges):
+        start, end = max(1, start - context), end + context
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def pack_chunks(chunks: List[Dict[str, Any]], max_tokens: int = REVIEW_CHUNK_TOKENS, size: str = "tokens") -> List[List[Dict[str, Any]]]:
+    """Group chunks into prompts of at most ``max_tokens`` tokens, keeping input order.
+
+    ``size`` names the chunk field to budget on, e.g. "prompt_tokens" for
+    the rendered (line-numbered) size.
+    """
+    groups, current, tokens = [], [], 0
+    for chunk in chunks:
+        if current and tokens + chunk[size] > max_tokens:
+            groups.append(current)
+            current, tokens = [], 0
+        current.append(chunk)
+        tokens += chunk[size]
+    if current:
+        groups.append(current)
+    return groups
+
+
+def render_chunk(chunk: Dict[str, Any]) -> str:
+    """Format a chunk with line numbers so findings can cite them"""
+    numbered = "\n".join(
+        f"{number}| {line}"
+        for number, line in enumerate(chunk["text"].split("\n"), start=chunk["start_line"])
+    )
+    return f"=== File: {chunk['path']} (lines {chunk['start_line']}-{chunk['end_line']}) ===\n{numbered}"
+
+
+def locate_finding(finding: Dict[str, Any], chunks: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Resolve a finding's ``file``/``line`` against the chunks it was reviewed in"""
+    path = finding.get("file") or finding.get("location")
+    line = finding.get("line")
+    try:
+        line = int(line) if line is not None else None
+    except (TypeError, ValueError):
+        line = None
+    candidates = [chunk for chunk in chunks if chunk["path"] == path] or (chunks if len({c["path"] for c in chunks}) == 1 else [])
+    chunk: Optional[Dict[str, Any]] = None
+    for candidate in candidates:
+        if line is None or candidate["start_line"] <= line <= candidate["end_line"]:
+            chunk = candidate
+            break
+    if chunk is None and candidates:
+        chunk, line = candidates[0], None
+    if chunk is None:
+        return {**finding, "location": path or "N/A"}
+    located = {key: value for key, value in finding.items() if key not in ("file", "line")}
+    located["location"] = f"{chunk['path']}:{line}" if line is not None else f"{chunk['path']}:{chunk['start_line']}-{chunk['end_line']}"
+    located["file"] = chunk["path"]
+    located["line"] = line
+    return located
@@ -0,0 +1,136 @@
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+import math
+import os
+import posixpath
+
+# Files larger than this are never sent for review, and the number of recent
+# commits whose diffs are used to measure churn (0 disables churn ranking).
+REVIEW_MAX_FILE_BYTES = int(os.getenv("REVIEW_MAX_FILE_BYTES", str(200 * 1024)))
+REVIEW_CHURN_COMMITS = int(os.getenv("REVIEW_CHURN_COMMITS", "20"))
+
+# Directories holding third-party, generated or build output
+SKIP_DIRECTORIES = {
+    ".git", "node_modules", "__pycache__", "vendor", "vendors", "third_party", "third-party",
+    "dist", "build", "target", "out", "bin", "obj", ".venv", "venv", "env", ".tox",
+    "coverage", ".next", ".nuxt", "bower_components", "Pods", "site-packages", ".idea", ".vscode",
+}
+
+LOCKFILES = {
+    "package-lock.json", "yarn.lock", "pnpm-lock.yaml", "npm-shrinkwrap.json", "poetry.lock",
+    "Pipfile.lock", "Cargo.lock", "go.sum", "composer.lock", "Gemfile.lock", "mix.lock",
+    "packages.lock.json", "gradle.lockfile", "pdm.lock", "uv.lock",
+}
+
+BINARY_EXTENSIONS = {
+    "png", "jpg", "jpeg", "gif", "bmp", "ico", "svg", "webp", "tiff", "psd",
+    "pdf", "doc", "docx", "xls", "xlsx", "ppt", "pptx",
+    "zip", "tar", "gz", "tgz", "bz2", "xz", "7z", "rar", "jar", "war", "ear", "whl", "egg",
+    "exe", "dll", "so", "dylib", "a", "o", "obj", "class", "pyc", "pyo", "wasm", "bin", "dat",
+    "mp3", "mp4", "wav", "ogg", "avi", "mov", "webm", "flac",
+    "ttf", "otf", "woff", "woff2", "eot", "db", "sqlite", "pkl", "npy", "parquet",
+}
+
+# Suffixes of minified, compiled or code-generated files
+GENERATED_SUFFIXES = (
+    ".min.js", ".min.css", ".map", "_pb2.py", "_pb2_grpc.py", ".pb.go", ".pb.cc", ".pb.h",
+    ".g.dart", ".freezed.dart", ".designer.cs", ".generated.ts", ".generated.js", ".snap",
+)
+
+SOURCE_EXTENSIONS = {
+    "py": "python", "js": "javascript", "jsx": "javascript", "mjs": "javascript",
+    "ts": "typescript", "tsx": "typescript", "java": "java", "kt": "java", "scala": "java",
+    "rb": "ruby", "php": "php", "go": "go", "rs": "rust", "c": "c", "h": "c",
+    "cc": "cpp", "cpp": "cpp", "hpp": "cpp", "cs": "csharp", "swift": "swift",
+    "sh": "shell", "bash": "shell", "sql": "sql", "vue": "javascript", "svelte": "javascript",
+}
+# Analysis languages that cover several source languages
+LANGUAGE_ALIASES = {"node": {"javascript", "typescript"}}
+CONFIG_EXTENSIONS = {"yml", "yaml", "toml", "ini", "cfg", "conf", "json", "xml", "tf", "gradle"}
+CONFIG_FILES = {"Dockerfile", "Makefile", "Jenkinsfile", "Procfile", ".gitlab-ci.yml", "docker-compose.yml"}
+DOC_EXTENSIONS = {"md", "rst", "txt", "adoc"}
+
+
+def _extension(path: str) -> str:
+    name = posixpath.basename(path)
+    return name.rsplit(".", 1)[-1].lower() if "." in name else ""
+
+
+def is_reviewable(path: str, size: Optional[int] = None) -> bool:
+    """Whether a file is worth an LLM review, judged by its path and (if known) size"""
+    name = posixpath.basename(path)
+    if any(part in SKIP_DIRECTORIES for part in path.split("/")[:-1]):
+        return False
+    if name in LOCKFILES or name.lower().startswith(("license", "licence", "copying", "notice")):
+        return False
+    if _extension(path) in BINARY_EXTENSIONS or path.lower().endswith(GENERATED_SUFFIXES):
+        return False
+    if size is not None and (size == 0 or size > REVIEW_MAX_FILE_BYTES):
+        return False
+    return True
+
+
+def is_reviewable_content(content: str) -> bool:
+    """Reject fetched content that turned out to be binary or too large"""
+    return "\0" not in content[:8192] and len(content.encode("utf-8", errors="replace")) <= REVIEW_MAX_FILE_BYTES
+
+
+def churn_from_commits(commits: Iterable[Dict[str, Any]]) -> Dict[str, Tuple[int, int]]:
+    """Map path -> (commits touching it, index of the newest such commit).
+
+    ``commits`` are ordered newest first, each with the ``paths`` it changed.
+    """
+    churn = {}
+    for index, commit in enumerate(commits):
+        for path in commit["paths"]:
+            count, newest = churn.get(path, (0, index))
+            churn[path] = (count + 1, newest)
+    return churn
+
+
+def _score(path: str, size: Optional[int], churn: Dict[str, Tuple[int, int]], language: Optional[str]) -> float:
+    name = posixpath.basename(path)
+    ext = _extension(path)
+    if ext in SOURCE_EXTENSIONS:
+        score = 3.0
+        if language and SOURCE_EXTENSIONS[ext] in LANGUAGE_ALIASES.get(language, {language}):
+            score += 2.0
+    elif name in CONFIG_FILES or ext in CONFIG_EXTENSIONS:
+        score = 1.0
+    elif ext in DOC_EXTENSIONS:
+        score = 0.2
+    else:
+        score = 0.5
+    # Tests matter, but less than the code they exercise
+    lowered = path.lower()
+    if "test" in lowered or "spec" in lowered:
+        score *= 0.8
+    # Near-empty files have little to review
+    if size is not None:
+        score *= min(1.0, 0.3 + math.log10(size + 1) / 4)
+    if path in churn:
+        count, newest = churn[path]
+        score += 2.0 * math.log1p(count) + 1.5 / (1 + newest)
+    return score
+
+
+def select_review_files(
+    entries: List[Dict[str, Any]],
+    max_files: int,
+    sizes: Optional[Dict[str, int]] = None,
+    churn: Optional[Dict[str, Tuple[int, int]]] = None,
+    language: Optional[str] = None,
+) -> List[Dict[str, Any]]:
+    """Filter out unreviewable blobs and return the ``max_files`` most relevant ones.
+
+    Files are ranked by kind (source in the project's language first, then
+    other source, configuration, documentation), size, and how often and how
+    recently they changed.
+    """
+    sizes = sizes or {}
+    churn = churn or {}
+    candidates = [
+        entry for entry in entries
+        if entry.get("type", "blob") == "blob" and is_reviewable(entry["path"], sizes.get(entry["path"]))
+    ]
+    candidates.sort(key=lambda entry: (-_score(entry["path"], sizes.get(entry["path"]), churn, language), entry["path"]))
+    return candidates[:max_files]
@@ -0,0 +1,230 @@
+from typing import Any, Dict, List, Optional
+import json
+import re
+from pydantic import BaseModel, ConfigDict, ValidationError, field_validator
+
+# A closing fence must start its own line: ``` inside a JSON string is not one
+FENCE_PATTERN = re.compile(r"```[a-zA-Z0-9_-]*[ \t]*\n?(.*?)(?:^[ \t]*```[ \t]*$|\Z)", re.DOTALL | re.MULTILINE)
+TRAILING_COMMA_PATTERN = re.compile(r",(\s*[}\]])")
+DANGLING_KEY_PATTERN = re.compile(r"[,{]\s*\"(?:[^\"\\]|\\.)*\"\s*:?\s*$")
+SCORE_PATTERN = re.compile(r"-?\d+(?:\.\d+)?")
+PYTHON_LITERALS = {"True": "true", "False": "false", "None": "null"}
+SEVERITIES = {"info", "low", "medium", "high", "critical"}
+
+
+class StructuredOutputError(ValueError):
+    """Raised when an LLM response holds no usable structured data"""
+
+
+class ReviewFinding(BaseModel):
+    model_config = ConfigDict(extra="allow")
+
+    type: str = "finding"
+    description: str
+    severity: str = "info"
+    file: Optional[str] = None
+    line: Optional[int] = None
+    recommendation: Optional[str] = None
+
+    @field_validator("severity", mode="before")
+    @classmethod
+    def normalize_severity(cls, value: Any) -> str:
+        severity = str(value or "info").strip().lower()
+        return severity if severity in SEVERITIES else "info"
+
+    @field_validator("line", mode="before")
+    @classmethod
+    def coerce_line(cls, value: Any) -> Optional[int]:
+        # Models write "12", "12-15" or "L12"; keep the first number
+        match = SCORE_PATTERN.search(str(value)) if value is not None else None
+        return int(float(match.group())) if match else None
+
+
+class FileReview(BaseModel):
+    findings: List[ReviewFinding] = []
+    recommendations: List[str] = []
+    # None when the response had no usable score (e.g. it was cut off)
+    score: Optional[float] = None
+
+    @field_validator("findings", mode="before")
+    @classmethod
+    def wrap_findings(cls, value: Any) -> List[Dict[str, Any]]:
+        findings = []
+        for item in value if isinstance(value, list) else [value]:
+            if isinstance(item, dict):
+                item = dict(item)
+                if "description" not in item:
+                    item["description"] = item.pop("message", None) or item.pop("issue", None) or json.dumps(item)
+                findings.append(item)
+            elif item:
+                # Wrap string findings as objects
+                findings.append({"description": str(item)})
+        return findings
+
+    @field_validator("recommendations", mode="before")
+    @classmethod
+    def stringify_recommendations(cls, value: Any) -> List[str]:
+        items = value if isinstance(value, list) else [value]
+        return [
+            item.get("description") or item.get("recommendation") or json.dumps(item) if isinstance(item, dict) else str(item)
+            for item in items if item
+        ]
+
+    @field_validator("score", mode="before")
+    @classmethod
+    def coerce_score(cls, value: Any) -> Optional[float]:
+        # Accept 7, "7", "7/10" or "7.5 out of 10"
+        match = SCORE_PATTERN.search(str(value)) if value is not None else None
+        if not match:
+            return None
+        return min(max(float(match.group()), 0.0), 10.0)
+
+
+class BatchFileReview(FileReview):
+    path: str
+    # A batch entry without a score is usually a truncated one
+    score: float
+
+
+def _strip_fences(text: str) -> str:
+    match = FENCE_PATTERN.search(text)
+    return match.group(1) if match else text
+
+
+def _balanced_span(text: str) -> str:
+    """The first JSON object/array in ``text``, or everything from its start if it never closes"""
+    start = min((i for i in (text.find("{"), text.find("[")) if i >= 0), default=-1)
+    if start < 0:
+        raise StructuredOutputError("no JSON object in response")
+    depth, in_string, escaped = 0, False, False
+    for index in range(start, len(text)):
+        char = text[index]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char in "{[":
+            depth += 1
+        elif char in "}]":
+            depth -= 1
+            if depth == 0:
+                return text[start:index + 1]
+    return text[start:]
+
+
+def _repair(text: str) -> str:
+    """Best-effort fix of common LLM JSON mistakes and of truncated output"""
+    out, stack = [], []
+    in_string, escaped = False, False
+    index = 0
+    while index < len(text):
+        char = text[index]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+            elif char == "\n":
+                char = "\\n"
+            out.append(char)
+        elif char == '"':
+            in_string = True
+            out.append(char)
+        elif char in "{[":
+            stack.append("}" if char == "{" else "]")
+            out.append(char)
+        elif char in "}]":
+            if stack:
+                stack.pop()
+            out.append(char)
+        else:
+            for literal, replacement in PYTHON_LITERALS.items():
+                if text.startswith(literal, index) and not text[index - 1:index].isalnum():
+                    out.append(replacement)
+                    index += len(literal)
+                    break
+            else:
+                out.append(char)
+                index += 1
+            continue
+        index += 1
+    repaired = "".join(out)
+    if in_string:
+        repaired += '"'
+    if stack:
+        # Truncated: drop dangling separators and keys, then close what is open
+        while True:
+            stripped = repaired.rstrip().rstrip(",").rstrip()
+            dangling = DANGLING_KEY_PATTERN.search(stripped) if stack[-1] == "}" else None
+            if dangling:
+                stripped = stripped[:dangling.start() + 1] if stripped[dangling.start()] == "{" else stripped[:dangling.start()]
+            if stripped == repaired:
+                break
+            repaired = stripped
+        repaired += "".join(reversed(stack))
+    return TRAILING_COMMA_PATTERN.sub(r"\1", repaired)
+
+
+def extract_json(text: str) -> Any:
+    """Parse the JSON value in an LLM response, tolerating fences, prose and truncation"""
+    if not text or not text.strip():
+        raise StructuredOutputError("empty response")
+    text = text.strip()
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError:
+        pass
+    candidate = _balanced_span(_strip_fences(text))
+    try:
+        return json.loads(candidate)
+    except json.JSONDecodeError:
+        pass
+    try:
+        return json.loads(_repair(candidate))
+    except json.JSONDecodeError as e:
+        raise StructuredOutputError(f"unparseable JSON: {e}") from e
+
+
+def parse_review(text: str) -> Dict[str, Any]:
+    """Parse a single review response into findings, recommendations and score.
+
+    A missing or unusable score comes back as None rather than costing the findings.
+    """
+    data = extract_json(text)
+    if isinstance(data, list):
+        data = {"findings": data}
+    if not isinstance(data, dict):
+        raise StructuredOutputError("review is not a JSON object")
+    try:
+        return FileReview.model_validate(data).model_dump()
+    except ValidationError as e:
+        raise StructuredOutputError(f"review does not match the schema: {e}") from e
+
+
+def parse_batch_review(text: str) -> Dict[str, Dict[str, Any]]:
+    """Parse a batch review response into per-file reviews keyed by path.
+
+    Entries that do not validate are left out, so the caller can ask for
+    those files again.
+    """
+    data = extract_json(text)
+    entries = data.get("files") if isinstance(data, dict) else data
+    if isinstance(entries, dict):
+        entries = [dict(entry, path=path) for path, entry in entries.items() if isinstance(entry, dict)]
+    if not isinstance(entries, list):
+        raise StructuredOutputError("batch review has no list of files")
+    reviews = {}
+    for entry in entries:
+        try:
+            review = BatchFileReview.model_validate(entry)
+        except ValidationError:
+            continue
+        reviews[review.path.strip()] = review.model_dump(exclude={"path"})
+    return reviews
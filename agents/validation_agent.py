@@ -1,12 +1,12 @@
 from typing import Any, Dict
-import gitlab
 from .base_agent import BaseAgent
+from .gitlab_client import AsyncGitLab, create_gitlab_client
 import os
 import json
 import ast
 
 class ValidationAgent(BaseAgent):
-    def __init__(self):
+    def __init__(self, gitlab_client: AsyncGitLab = None):
         """Initialize the ValidationAgent with GitLab configuration"""
         super().__init__()
         self.gitlab_url = os.getenv("GITLAB_URL")
@@ -19,7 +19,9 @@ class ValidationAgent(BaseAgent):
         print(f"[ValidationAgent] Initializing with GitLab URL: {self.gitlab_url}")
         print(f"[ValidationAgent] Using GitLab Token (first 4 chars): {self.gitlab_token[:4]}...")
             
-        self.gl = gitlab.Gitlab(self.gitlab_url, private_token=self.gitlab_token)
+        # Prefer the shared, pooled client; build a private one otherwise
+        self.gitlab = gitlab_client or create_gitlab_client(self.gitlab_url, self.gitlab_token)
+        self.gl = self.gitlab.gl
     
     async def _get_suggestions(self, pipeline_yaml: str, errors: list) -> list:
         """Get suggestions from OpenAI with caching"""
@@ -73,7 +75,7 @@ class ValidationAgent(BaseAgent):
             # Get project
             project_path = self._extract_project_path(repo_url)
             print(f"[ValidationAgent] Extracted project_path: {project_path}")
-            project = self.gl.projects.get(project_path)
+            project = await self.gitlab.get_project(project_path)
             print("[ValidationAgent] Successfully retrieved project object")
 
             # Validate pipeline
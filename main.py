@@ -1,21 +1,42 @@
-from fastapi import FastAPI, HTTPException, Depends, BackgroundTasks
+from fastapi import FastAPI, HTTPException, Depends, BackgroundTasks, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel, HttpUrl
 from typing import Optional, Dict, Any, List
 import os
 from dotenv import load_dotenv
-from agents.code_analysis_agent import CodeAnalysisAgent
+from agents.code_analysis_agent import CodeAnalysisAgent, MAX_TREE_ENTRIES
 from agents.pipeline_agent import PipelineAgent
 from agents.validation_agent import ValidationAgent
 from agents.deployment_agent import DeploymentAgent
-from datetime import datetime
+from agents.code_review_agent import CodeReviewAgent, REVIEW_MAX_FILES, REVIEW_MAX_FILES_LIMIT, review_cache
+from agents.review_selection import select_review_files, churn_from_commits, REVIEW_CHURN_COMMITS
 import json
-from operation_store import get_operation, set_operation
+from operation_store import get_operation, cache_stats, store_stats, STORE_BACKEND
+from operation_ids import new_operation_id
+from operation_retention import retention_loop, compaction_loop, retention_stats, RETENTION_INTERVAL, COMPACT_INTERVAL
+from operation_events import subscribe, unsubscribe, subscriber_count
+from operation_progress import OperationProgress
+from agents.analysis_cache import analysis_cache
+from agents.gitlab_client import AsyncGitLab, create_gitlab_client
+from agents.llm_scheduler import llm_scheduler
+from agents.openai_client import close_openai_client
+from agents.llm_cache import llm_cache
+import asyncio
 import re
 
 # Load environment variables
 load_dotenv()
 
+# Status streams re-check the store this often so updates written by other
+# workers are still delivered, and give up after STREAM_TIMEOUT seconds.
+STREAM_POLL_INTERVAL = float(os.getenv("STATUS_STREAM_POLL_INTERVAL", "15"))
+STREAM_TIMEOUT = float(os.getenv("STATUS_STREAM_TIMEOUT", "900"))
+# Comma-separated addresses of reverse proxies whose X-Forwarded-For header
+# is believed when identifying callers; "*" trusts whichever peer connects.
+# Anyone else could put any address there, so by default it is ignored.
+TRUSTED_PROXIES = {address.strip() for address in os.getenv("TRUSTED_PROXIES", "").split(",") if address.strip()}
+
 app = FastAPI(
     title="AI Pipeline Generator",
     description="An AI-powered platform for generating and deploying CI/CD pipelines",
@@ -36,12 +57,59 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Lifecycle
+@app.on_event("startup")
+async def start_background_jobs():
+    # One pooled GitLab client shared by every request's agents
+    try:
+        app.state.gitlab_client = create_gitlab_client()
+    except ValueError as e:
+        print(f"Warning: shared GitLab client not created: {e}")
+        app.state.gitlab_client = None
+    if RETENTION_INTERVAL > 0:
+        app.state.retention_task = asyncio.create_task(retention_loop())
+    # The log grows with every write, so compact it even without retention
+    if STORE_BACKEND == "log" and COMPACT_INTERVAL > 0:
+        app.state.compaction_task = asyncio.create_task(compaction_loop())
+
+@app.on_event("shutdown")
+async def stop_background_jobs():
+    for name in ("retention_task", "compaction_task"):
+        task = getattr(app.state, name, None)
+        if task:
+            task.cancel()
+    gitlab_client = getattr(app.state, "gitlab_client", None)
+    if gitlab_client:
+        gitlab_client.close()
+    await llm_scheduler.shutdown()
+    await close_openai_client()
+
+# Dependencies
+def get_gitlab_client(request: Request) -> Optional[AsyncGitLab]:
+    """Shared GitLab client; None lets agents build their own (and report missing config)"""
+    return getattr(request.app.state, "gitlab_client", None)
+
+def get_client_id(request: Request) -> str:
+    """Identify the caller for fair queuing of LLM requests"""
+    host = request.client.host if request.client else "unknown"
+    if "*" not in TRUSTED_PROXIES and host not in TRUSTED_PROXIES:
+        return host
+    # Each proxy appends the address it saw, so only the entries added by
+    # trusted proxies can be believed: take the last one they did not add.
+    forwarded = [address.strip() for address in request.headers.get("x-forwarded-for", "").split(",") if address.strip()]
+    for address in reversed(forwarded):
+        host = address
+        if "*" in TRUSTED_PROXIES or address not in TRUSTED_PROXIES:
+            break
+    return host
+
 # Models
 class RepositoryAnalysis(BaseModel):
     repo_url: HttpUrl
     branch: Optional[str] = "main"
     language: Optional[str] = None
     deploy_to_cloud: Optional[bool] = False
+    analysis_mode: Optional[str] = None  # "tree" or "archive"
 
 class PipelineResponse(BaseModel):
     status: str
@@ -56,6 +124,14 @@ class CodeReviewRequest(BaseModel):
     repo_url: HttpUrl
     branch: Optional[str] = "main"
     focus_areas: Optional[List[str]] = ["security", "performance", "best_practices"]
+    analysis_mode: Optional[str] = None  # "tree" or "archive"
+    max_files: Optional[int] = None  # defaults to REVIEW_MAX_FILES, capped at REVIEW_MAX_FILES_LIMIT
+    batch: Optional[bool] = False  # review many files per OpenAI request
+    # Diff review: a merge request, or a base..head range, instead of the whole branch
+    merge_request_iid: Optional[int] = None
+    base: Optional[str] = None
+    head: Optional[str] = None
+    previous_review_id: Optional[str] = None  # reuse its findings for unchanged files
 
 class CodeReviewResponse(BaseModel):
     review_id: str
@@ -81,28 +157,34 @@ async def root():
             "/validate",
             "/deploy",
             "/code-review",
-            "/status/{operation_id}"
+            "/status/{operation_id}",
+            "/status/{operation_id}/stream",
+            "/metrics"
         ]
     }
 
 @app.post("/analyze", response_model=Dict[str, Any])
-async def analyze_repository(repo: RepositoryAnalysis, background_tasks: BackgroundTasks):
+async def analyze_repository(repo: RepositoryAnalysis, background_tasks: BackgroundTasks, gitlab_client: Optional[AsyncGitLab] = Depends(get_gitlab_client)):
     """
     Analyze a GitLab repository to understand its structure and requirements
     """
     try:
-        operation_id = f"analyze_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
-        agent = CodeAnalysisAgent()
+        operation_id = new_operation_id("analyze")
+        agent = CodeAnalysisAgent(gitlab_client)
+        progress = OperationProgress(operation_id, message="Repository analysis queued")
         
         # Start analysis in background
         async def run_analysis():
+            progress.start()
             result = await agent.execute({
                 "repo_url": str(repo.repo_url),
-                "branch": repo.branch
+                "branch": repo.branch,
+                "mode": repo.analysis_mode,
+                "progress": progress
             })
-            set_operation(operation_id, result)
+            progress.finish(result)
         
-        background_tasks.add_task(run_analysis)
+        background_tasks.add_task(progress.run, run_analysis)
         
         return {
             "status": "processing",
@@ -113,21 +195,27 @@ async def analyze_repository(repo: RepositoryAnalysis, background_tasks: Backgro
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/generate-pipeline", response_model=PipelineResponse)
-async def generate_pipeline(repo: RepositoryAnalysis, background_tasks: BackgroundTasks):
+async def generate_pipeline(repo: RepositoryAnalysis, background_tasks: BackgroundTasks, gitlab_client: Optional[AsyncGitLab] = Depends(get_gitlab_client)):
     """
     Generate a CI/CD pipeline based on repository analysis
     """
+    progress = None
     try:
-        operation_id = f"generate_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+        operation_id = new_operation_id("generate")
         
         # First analyze the repository
-        analysis_agent = CodeAnalysisAgent()
+        analysis_agent = CodeAnalysisAgent(gitlab_client)
+        progress = OperationProgress(operation_id, message="Pipeline generation queued")
+        progress.start()
         analysis_result = await analysis_agent.execute({
             "repo_url": str(repo.repo_url),
-            "branch": repo.branch
+            "branch": repo.branch,
+            "mode": repo.analysis_mode,
+            "progress": progress
         })
         
         if analysis_result["status"] == "error":
+            progress.finish(analysis_result)
             raise HTTPException(status_code=500, detail=analysis_result["message"])
         
         # Generate pipeline
@@ -138,9 +226,10 @@ async def generate_pipeline(repo: RepositoryAnalysis, background_tasks: Backgrou
                 "repo_url": str(repo.repo_url),
                 "branch": repo.branch
             })
-            set_operation(operation_id, result)
+            progress.stage("pipeline_generated")
+            progress.finish(result)
         
-        background_tasks.add_task(run_generation)
+        background_tasks.add_task(progress.run, run_generation)
         
         return PipelineResponse(
             status="processing",
@@ -149,25 +238,30 @@ async def generate_pipeline(repo: RepositoryAnalysis, background_tasks: Backgrou
             data=analysis_result["data"]
         )
     except Exception as e:
+        if progress is not None and not progress.done:
+            progress.fail(e)
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/validate")
-async def validate_pipeline(request: ValidationRequest, background_tasks: BackgroundTasks):
+async def validate_pipeline(request: ValidationRequest, background_tasks: BackgroundTasks, gitlab_client: Optional[AsyncGitLab] = Depends(get_gitlab_client), client_id: str = Depends(get_client_id)):
     """
     Validate the generated pipeline using GitLab CI Lint API
     """
     try:
-        operation_id = f"validate_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
-        agent = ValidationAgent()
+        operation_id = new_operation_id("validate")
+        agent = ValidationAgent(gitlab_client)
+        agent.llm_client_id = client_id
+        progress = OperationProgress(operation_id, message="Pipeline validation queued")
         
         async def run_validation():
+            progress.start()
             result = await agent.execute({
                 "pipeline_yaml": request.pipeline_yaml,
                 "repo_url": str(request.repo_url)
             })
-            set_operation(operation_id, result)
+            progress.finish(result)
         
-        background_tasks.add_task(run_validation)
+        background_tasks.add_task(progress.run, run_validation)
         
         return {
             "status": "processing",
@@ -178,23 +272,25 @@ async def validate_pipeline(request: ValidationRequest, background_tasks: Backgr
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/deploy")
-async def deploy_pipeline(repo: RepositoryAnalysis, pipeline_yaml: str, background_tasks: BackgroundTasks):
+async def deploy_pipeline(repo: RepositoryAnalysis, pipeline_yaml: str, background_tasks: BackgroundTasks, gitlab_client: Optional[AsyncGitLab] = Depends(get_gitlab_client)):
     """
     Deploy the validated pipeline to GitLab
     """
     try:
-        operation_id = f"deploy_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
-        agent = DeploymentAgent()
+        operation_id = new_operation_id("deploy")
+        agent = DeploymentAgent(gitlab_client)
+        progress = OperationProgress(operation_id, message="Pipeline deployment queued")
         
         async def run_deployment():
+            progress.start()
             result = await agent.execute({
                 "pipeline_yaml": pipeline_yaml,
                 "repo_url": str(repo.repo_url),
                 "deploy_to_cloud": repo.deploy_to_cloud
             })
-            set_operation(operation_id, result)
+            progress.finish(result)
         
-        background_tasks.add_task(run_deployment)
+        background_tasks.add_task(progress.run, run_deployment)
         
         return {
             "status": "processing",
@@ -214,130 +310,200 @@ async def get_operation_status(operation_id: str):
         raise HTTPException(status_code=404, detail="Operation not found")
     return op
 
+@app.get("/status/{operation_id}/stream")
+async def stream_operation_status(operation_id: str, request: Request):
+    """
+    Stream status updates of an async operation as Server-Sent Events.
+    Each state written for the operation is pushed as a "status" event and
+    the stream ends once the operation is no longer processing.
+    """
+    if not get_operation(operation_id):
+        raise HTTPException(status_code=404, detail="Operation not found")
+
+    async def events():
+        queue = subscribe(operation_id)
+        try:
+            loop = asyncio.get_running_loop()
+            deadline = loop.time() + STREAM_TIMEOUT
+            op = get_operation(operation_id)
+            last_sent = None
+            while True:
+                if op is not None and op != last_sent:
+                    yield f"event: status\ndata: {json.dumps(op)}\n\n"
+                    last_sent = op
+                    if op.get("status") != "processing":
+                        return
+                else:
+                    # Comment line keeps proxies from closing an idle stream.
+                    yield ": keep-alive\n\n"
+                if await request.is_disconnected():
+                    return
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    yield "event: timeout\ndata: {}\n\n"
+                    return
+                try:
+                    op = await asyncio.wait_for(queue.get(), timeout=min(STREAM_POLL_INTERVAL, remaining))
+                except asyncio.TimeoutError:
+                    op = get_operation(operation_id)
+        finally:
+            unsubscribe(operation_id, queue)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.get("/metrics")
+async def get_metrics():
+    """
+    Report internal counters used to size caches and stores
+    """
+    return {
+        "operation_store": store_stats(),
+        "operation_cache": cache_stats(),
+        "operation_retention": retention_stats,
+        "analysis_cache": analysis_cache.stats(),
+        "llm_scheduler": llm_scheduler.stats(),
+        "llm_cache": llm_cache.stats(),
+        "review_cache": review_cache.stats(),
+        "status_stream_subscribers": subscriber_count()
+    }
+
 @app.post("/code-review", response_model=CodeReviewResponse)
-async def review_code(request: CodeReviewRequest, background_tasks: BackgroundTasks):
+async def review_code(request: CodeReviewRequest, background_tasks: BackgroundTasks, gitlab_client: Optional[AsyncGitLab] = Depends(get_gitlab_client), client_id: str = Depends(get_client_id)):
     """
     Perform a code review using OpenAI
     """
     try:
-        operation_id = f"review_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+        operation_id = new_operation_id("review")
+        progress = OperationProgress(operation_id, id_field="review_id", message="Code review queued")
         
         async def run_review():
-            # Perform analysis to get repo details
-            analysis_agent = CodeAnalysisAgent()
-            analysis_result = await analysis_agent.execute({
-                "repo_url": str(request.repo_url),
-                "branch": request.branch
-            })
+            progress.start()
+            analysis_agent = CodeAnalysisAgent(gitlab_client)
+            review_agent = CodeReviewAgent(analysis_agent.gitlab)
+            review_agent.llm_client_id = client_id
+            if request.batch:
+                review_agent.enable_batch_mode()
+            diff_mode = request.merge_request_iid is not None or bool(request.base)
+            project_path = analysis_agent._extract_project_path(str(request.repo_url))
+            snapshot = None
+            regions = None
+            base_sha = None
             
-            if analysis_result["status"] == "error":
-                set_operation(operation_id, {
-                    "review_id": operation_id,
-                    "status": "error",
-                    "message": analysis_result["message"],
-                    "findings": [],
-                    "recommendations": [],
-                    "score": 0
+            if diff_mode:
+                # Review only what the merge request (or base..head range) changed
+                try:
+                    project = await analysis_agent.gitlab.get_project(project_path)
+                    diff = await review_agent.resolve_diff(
+                        project, request.merge_request_iid, request.base, request.head or request.branch
+                    )
+                except Exception as e:
+                    progress.finish({
+                        "review_id": operation_id,
+                        "status": "error",
+                        "message": f"Could not resolve the diff to review: {e}",
+                        "findings": [],
+                        "recommendations": [],
+                        "score": 0
+                    })
+                    return
+                base_sha, commit_sha = diff["base_sha"], diff["head_sha"]
+                review_agent.diff_mode = True
+                tree, regions = diff["files"], diff["regions"]
+                churn, language = {}, None
+                progress.stage("diff_resolved", files_changed=len(tree))
+            else:
+                # Perform analysis to get repo details
+                analysis_result = await analysis_agent.execute({
+                    "repo_url": str(request.repo_url),
+                    "branch": request.branch,
+                    "mode": request.analysis_mode,
+                    "progress": progress
                 })
-                return
+                
+                if analysis_result["status"] == "error":
+                    progress.finish({
+                        "review_id": operation_id,
+                        "status": "error",
+                        "message": analysis_result["message"],
+                        "findings": [],
+                        "recommendations": [],
+                        "score": 0
+                    })
+                    return
 
-            # Get repository content for review
-            project_path = analysis_agent._extract_project_path(str(request.repo_url))
-            project = analysis_agent.gl.projects.get(project_path)
-            
-            # Get main code files
-            files = project.repository_tree(ref=request.branch, recursive=True)
-            code_files = [f for f in files if f["type"] == "blob" and not f["path"].startswith((".git", "node_modules", "__pycache__"))]
-            print(f"[DEBUG] Found {len(code_files)} code files to review: {[f['path'] for f in code_files]}")
-            if not code_files:
+                # Get repository content for review
+                project = await analysis_agent.gitlab.get_project(project_path)
+                commit_sha = analysis_result["data"].get("commit_sha") or request.branch
+                language = analysis_result["data"].get("analysis", {}).get("language")
+                
+                # Get main code files, from the archive snapshot or the blobs the
+                # analysis walked; only walk the tree again when it has neither.
+                snapshot = analysis_agent.snapshot
+                if snapshot:
+                    tree = [{"path": path, "type": "blob"} for path in snapshot["paths"]]
+                elif analysis_agent.blobs is not None:
+                    tree = [{"path": path, "id": blob_id, "type": "blob"} for path, blob_id in analysis_agent.blobs]
+                else:
+                    tree = []
+                    async for entry in analysis_agent.gitlab.iter_repository_tree(project, ref=commit_sha):
+                        if entry["type"] == "blob":
+                            tree.append(entry)
+                            if len(tree) >= MAX_TREE_ENTRIES:
+                                print(f"[DEBUG] Review tree walk stopped after {len(tree)} files")
+                                break
+                
+                # Rank files so the review budget goes to recently and often changed source
+                churn = {}
+                if REVIEW_CHURN_COMMITS > 0:
+                    try:
+                        churn = churn_from_commits(await analysis_agent.gitlab.recent_changes(project, commit_sha, REVIEW_CHURN_COMMITS))
+                    except Exception as e:
+                        print(f"[DEBUG] Churn lookup failed, ranking without it: {e}")
+            files_to_review = select_review_files(
+                tree,
+                max(1, min(request.max_files or REVIEW_MAX_FILES, REVIEW_MAX_FILES_LIMIT)),
+                sizes=snapshot.get("sizes") if snapshot else None,
+                churn=churn,
+                language=language
+            )
+            print(f"[DEBUG] Selected {len(files_to_review)} of {len(tree)} tree entries for review")
+            if not files_to_review:
                 print("[DEBUG] No code files found for review.")
             
-            # Review each file
-            findings = []
-            recommendations = []
-            total_score = 0
-            files_reviewed = 0
-            openai_failed = False
-            openai_error_message = None
+            # Files unchanged since a previous review keep its findings
+            reused = {}
+            if request.previous_review_id:
+                try:
+                    reused = await review_agent.reusable_results(
+                        project, get_operation(request.previous_review_id), commit_sha, [f["path"] for f in files_to_review], request.focus_areas
+                    )
+                except Exception as e:
+                    print(f"[DEBUG] Previous review not reusable: {e}")
+            files_to_review = [f for f in files_to_review if f["path"] not in reused]
+            progress.stage("files_selected", files_total=len(files_to_review), files_reused=len(reused), files_reviewed=0)
             
-            try:
-                for file in code_files[:5]:  # Limit to first 5 files to avoid rate limits
-                    try:
-                        content = project.files.get(file["path"], request.branch).decode().decode()
-                        
-                        # Create review prompt with explicit JSON instructions
-                        prompt = f"""Review this code file ({file['path']}) for:
-1. Code quality and best practices
-2. Potential bugs or issues
-3. Security concerns
-4. Performance improvements
-5. Maintainability
-
-Focus areas: {', '.join(request.focus_areas)}
-
-Provide the review strictly as a valid JSON object with the following keys: "findings" (list of strings), "recommendations" (list of strings), and "score" (number between 0 and 10).
-
-Code:
-{content[:2000]}  # Limit content length
-"""
-                        
-                        # Get review from OpenAI
-                        try:
-                            review = await analysis_agent._call_openai(prompt)
-                            print(f"[DEBUG] OpenAI review response for {file['path']}: {review}")
-                            
-                            try:
-                                # Attempt to parse the review as JSON
-                                review_data = json.loads(review)
-                                # Wrap string findings as objects
-                                for finding in review_data.get("findings", []):
-                                    if isinstance(finding, dict):
-                                        findings.append(finding)
-                                    else:
-                                        findings.append({
-                                            "type": "finding",
-                                            "description": finding,
-                                            "severity": "info",
-                                            "location": file["path"],
-                                            "recommendation": None
-                                        })
-                                # Wrap string recommendations as objects (optional, if frontend expects)
-                                recommendations.extend(review_data.get("recommendations", []))
-                                total_score += review_data.get("score", 0)
-                                files_reviewed += 1
-                            except json.JSONDecodeError as json_e:
-                                # Handle JSON parsing errors gracefully
-                                print(f"[ERROR] JSON parsing failed for {file['path']}: {json_e}")
-                                print(f"[ERROR] Malformed JSON response: {review}")
-                                findings.append({
-                                    "type": "error",
-                                    "severity": "low",
-                                    "description": f"Failed to parse review for {file['path']} due to invalid JSON response from AI.",
-                                    "location": file["path"]
-                                })
-                                # Do NOT break here, continue with other files
-
-                        except Exception as oe:
-                            # Handle other OpenAI call errors (like quota exceeded)
-                            openai_failed = True
-                            openai_error_message = str(oe)
-                            print(f"[ERROR] OpenAI failed for {file['path']}: {oe}")
-                            break  # Stop further OpenAI calls if one fails
-                    except Exception as e:
-                        findings.append({
-                            "type": "error",
-                            "severity": "medium",
-                            "description": f"Error reviewing {file['path']}: {str(e)}",
-                            "location": file["path"]
-                        })
-                print(f"[DEBUG] Finished reviewing files. Files reviewed: {files_reviewed}")
-            except Exception as e:
-                openai_failed = True
-                openai_error_message = str(e)
-                print(f"[ERROR] Unexpected error in code review: {e}")
+            # Review the files concurrently; failed files are reported, not fatal
+            review_result = await review_agent.execute({
+                "project": project,
+                "branch": commit_sha,
+                "files": files_to_review,
+                "focus_areas": request.focus_areas,
+                "snapshot": snapshot,
+                "regions": regions,
+                "progress": progress
+            })
+            review_data = review_result["data"] or {}
+            files_reviewed = review_data.get("files_reviewed", 0)
+            file_scores = dict(review_data.get("file_scores") or {})
+            openai_failed = review_result["status"] == "error" or (files_reviewed == 0 and not reused)
             
             # Fallback to mock review if OpenAI failed or no files reviewed
-            if openai_failed or files_reviewed == 0:
+            if openai_failed:
+                openai_error_message = review_data.get("openai_error") or (review_result["message"] if review_result["status"] == "error" else None)
                 findings = [
                     {
                         "type": "mock_review",
@@ -354,30 +520,34 @@ Code:
                 score = 50
                 summary = f"OpenAI review failed: {openai_error_message or 'Unknown error'}. Returned mock review."
             else:
-                # Calculate average score (each file is already scored 0-10)
-                score = total_score / files_reviewed if files_reviewed > 0 else 0
-                # Ensure score is between 0-10
-                score = min(max(score, 0), 10)
-                # Get overall recommendations
-                if findings or recommendations:
-                    summary_prompt = f"""Based on these findings and recommendations, provide a summary of the most important improvements needed:\nFindings: {json.dumps(findings)}\nRecommendations: {json.dumps(recommendations)}\n\nReturn a brief summary paragraph."""
-                    try:
-                        summary = await analysis_agent._call_openai(summary_prompt)
-                    except Exception as oe:
-                        summary = f"OpenAI summary failed: {oe}."
-                else:
-                    summary = "No significant issues found in the reviewed files."
-            set_operation(operation_id, {
+                findings = review_data.get("findings", [])
+                recommendations = review_data.get("recommendations", [])
+                for path, previous in reused.items():
+                    findings.extend(previous["findings"])
+                    file_scores[path] = previous["score"]
+                # Average over reviewed and reused files, each scored 0-10
+                score = min(max(sum(file_scores.values()) / len(file_scores), 0), 10) if file_scores else None
+                summary = review_data.get("summary") or "No files changed since the previous review; its findings were reused."
+            progress.finish({
                 "review_id": operation_id,
                 "status": "completed",
                 "message": "Code review completed" if not openai_failed else "Code review completed with mock fallback due to OpenAI error.",
                 "findings": findings,
                 "recommendations": recommendations,
                 "score": score,
-                "summary": summary
+                "summary": summary,
+                "files_reviewed": files_reviewed,
+                "files_cached": review_data.get("files_cached", 0),
+                "files_skipped": review_data.get("files_skipped", 0),
+                "files_failed": review_data.get("files_failed", len(files_to_review)),
+                "files_reused": len(reused),
+                "file_scores": file_scores,
+                "commit_sha": commit_sha,
+                "base_sha": base_sha,
+                "review_settings": review_agent.review_settings(request.focus_areas)
             })
         
-        background_tasks.add_task(run_review)
+        background_tasks.add_task(progress.run, run_review, findings=[], recommendations=[], score=0)
         
         return CodeReviewResponse(
             review_id=operation_id,
@@ -391,24 +561,31 @@ Code:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/generate-pipeline-ai", response_model=PipelineResponse)
-async def generate_pipeline_ai(repo: RepositoryAnalysis, background_tasks: BackgroundTasks):
+async def generate_pipeline_ai(repo: RepositoryAnalysis, background_tasks: BackgroundTasks, gitlab_client: Optional[AsyncGitLab] = Depends(get_gitlab_client), client_id: str = Depends(get_client_id)):
     """
     Generate a CI/CD pipeline using OpenAI (on demand, credit usage warning)
     """
+    progress = None
     try:
-        operation_id = f"generateai_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
-        analysis_agent = CodeAnalysisAgent()
+        operation_id = new_operation_id("generateai")
+        analysis_agent = CodeAnalysisAgent(gitlab_client)
+        analysis_agent.llm_client_id = client_id
+        progress = OperationProgress(operation_id, message="Pipeline generation with OpenAI queued")
+        progress.start()
         analysis_result = await analysis_agent.execute({
             "repo_url": str(repo.repo_url),
-            "branch": repo.branch
+            "branch": repo.branch,
+            "mode": repo.analysis_mode,
+            "progress": progress
         })
         if analysis_result["status"] == "error":
+            progress.finish(analysis_result)
             raise HTTPException(status_code=500, detail=analysis_result["message"])
         async def run_generation():
             # Compose a prompt for OpenAI
             prompt = f"""Generate a GitLab CI/CD pipeline YAML for the following project.\nLanguage: {analysis_result['data'].get('language', 'unknown')}\nFiles: {', '.join(analysis_result['data'].get('structure', {}).get('files', [])[:10])}\nRequirements: {repo.repo_url} ({repo.branch})\nReturn only the YAML, no explanation."""
             try:
-                pipeline_yaml = await analysis_agent._call_openai(prompt)
+                pipeline_yaml = await analysis_agent._call_openai(prompt, on_token=progress.partial)
                 print(f"[DEBUG] OpenAI pipeline_yaml response BEFORE STRIP: {pipeline_yaml}")
                 # Strip markdown code block if present
                 if pipeline_yaml.strip().startswith("```"):
@@ -416,14 +593,15 @@ async def generate_pipeline_ai(repo: RepositoryAnalysis, background_tasks: Backg
                 print(f"[DEBUG] OpenAI pipeline_yaml response AFTER STRIP: {pipeline_yaml}")
             except Exception as oe:
                 pipeline_yaml = f"OpenAI error: {oe}"
-            set_operation(operation_id, {
+            progress.stage("pipeline_generated")
+            progress.finish({
                 "status": "completed",
                 "message": "Pipeline generated with OpenAI. This used your OpenAI credits.",
                 "operation_id": operation_id,
                 "pipeline_yaml": pipeline_yaml,
                 "data": analysis_result["data"]
             })
-        background_tasks.add_task(run_generation)
+        background_tasks.add_task(progress.run, run_generation)
         return PipelineResponse(
             status="processing",
             message="Pipeline generation with OpenAI started. This will use your OpenAI credits.",
@@ -431,33 +609,38 @@ async def generate_pipeline_ai(repo: RepositoryAnalysis, background_tasks: Backg
             data=analysis_result["data"]
         )
     except Exception as e:
+        if progress is not None and not progress.done:
+            progress.fail(e)
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/validate-pipeline-ai")
-async def validate_pipeline_ai(request: ValidationRequest, background_tasks: BackgroundTasks):
+async def validate_pipeline_ai(request: ValidationRequest, background_tasks: BackgroundTasks, gitlab_client: Optional[AsyncGitLab] = Depends(get_gitlab_client), client_id: str = Depends(get_client_id)):
     """
     Validate the pipeline YAML using OpenAI (on demand, credit usage warning)
     """
     try:
-        operation_id = f"validateai_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
-        agent = ValidationAgent()
+        operation_id = new_operation_id("validateai")
+        agent = ValidationAgent(gitlab_client)
+        agent.llm_client_id = client_id
+        progress = OperationProgress(operation_id, message="Pipeline validation with OpenAI queued")
         async def run_validation():
+            progress.start()
             prompt = f"""Review the following GitLab CI/CD pipeline YAML for errors, best practices, and improvements.\nReturn a JSON object with keys: valid (bool), errors (list), warnings (list), suggestions (list).\nYAML:\n{request.pipeline_yaml}"""
             try:
-                validation_result = await agent._call_openai(prompt)
-                set_operation(operation_id, {
+                validation_result = await agent._call_openai(prompt, on_token=progress.partial)
+                progress.finish({
                     "status": "completed",
                     "message": "Pipeline validated with OpenAI. This used your OpenAI credits.",
                     "operation_id": operation_id,
                     "validation_result": validation_result
                 })
             except Exception as oe:
-                set_operation(operation_id, {
+                progress.finish({
                     "status": "error",
                     "message": f"OpenAI error: {oe}",
                     "operation_id": operation_id
                 })
-        background_tasks.add_task(run_validation)
+        background_tasks.add_task(progress.run, run_validation)
         return {
             "status": "processing",
             "message": "Pipeline validation with OpenAI started. This will use your OpenAI credits.",
@@ -0,0 +1,52 @@
+import asyncio
+import copy
+from threading import Lock
+
+from operation_store import add_listener
+
+# Only the latest few states matter to a subscriber; older ones are dropped
+# when a slow client falls behind.
+SUBSCRIBER_QUEUE_SIZE = 16
+
+_subscribers = {}  # op_id -> {queue: loop}
+_lock = Lock()
+
+def subscribe(op_id: str) -> asyncio.Queue:
+    """Return a queue that receives every state written for ``op_id``."""
+    queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+    with _lock:
+        _subscribers.setdefault(op_id, {})[queue] = asyncio.get_running_loop()
+    return queue
+
+def unsubscribe(op_id: str, queue: asyncio.Queue):
+    with _lock:
+        queues = _subscribers.get(op_id)
+        if queues is not None:
+            queues.pop(queue, None)
+            if not queues:
+                del _subscribers[op_id]
+
+def subscriber_count() -> int:
+    with _lock:
+        return sum(len(queues) for queues in _subscribers.values())
+
+def _deliver(queue: asyncio.Queue, data):
+    if queue.full():
+        queue.get_nowait()
+    queue.put_nowait(data)
+
+def _publish(op_id: str, data):
+    with _lock:
+        targets = list(_subscribers.get(op_id, {}).items())
+    if not targets:
+        return
+    data = copy.deepcopy(data)
+    for queue, loop in targets:
+        # set_operation may run on a worker thread; hop onto the subscriber's loop.
+        try:
+            loop.call_soon_threadsafe(_deliver, queue, data)
+        except RuntimeError:
+            # The subscriber's loop has closed; its stream is already gone.
+            unsubscribe(op_id, queue)
+
+add_listener(_publish)
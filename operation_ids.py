@@ -0,0 +1,45 @@
+import os
+import time
+from threading import Lock
+
+# Crockford base32, as used by ULID; preserves sort order of the encoded value.
+_ALPHABET = "0123456789ABCDEFGHJKMNPQRSTVWXYZ"
+_RANDOM_BITS = 80
+_RANDOM_MAX = (1 << _RANDOM_BITS) - 1
+
+_lock = Lock()
+_last_ms = -1
+_last_random = 0
+
+def _encode(value: int, length: int) -> str:
+    chars = []
+    for _ in range(length):
+        chars.append(_ALPHABET[value & 31])
+        value >>= 5
+    return "".join(reversed(chars))
+
+def new_ulid() -> str:
+    """Return a 26-character ULID that is strictly increasing within the process.
+
+    IDs generated in the same millisecond reuse the timestamp and increment
+    the random component, so bursts stay both unique and ordered.
+    """
+    global _last_ms, _last_random
+    with _lock:
+        now_ms = time.time_ns() // 1_000_000
+        if now_ms <= _last_ms:
+            now_ms = _last_ms
+            _last_random += 1
+            if _last_random > _RANDOM_MAX:
+                # Random space for this millisecond exhausted; borrow the next one.
+                now_ms += 1
+                _last_random = int.from_bytes(os.urandom(10), "big") >> 1
+        else:
+            # Keep headroom so increments within the millisecond can't overflow.
+            _last_random = int.from_bytes(os.urandom(10), "big") >> 1
+        _last_ms = now_ms
+        return _encode(now_ms, 10) + _encode(_last_random, 16)
+
+def new_operation_id(op_type: str) -> str:
+    """Build an operation ID such as ``analyze_01HZX3...`` for the given type."""
+    return f"{op_type}_{new_ulid()}"
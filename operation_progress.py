@@ -0,0 +1,111 @@
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from operation_store import set_operation
+
+# Minimum seconds between writes of streamed partial output, so a fast token
+# stream does not turn into a store write (and status event) per token.
+PARTIAL_OUTPUT_INTERVAL = float(os.getenv("PARTIAL_OUTPUT_INTERVAL", "0.5"))
+
+
+class OperationProgress:
+    """Track an operation's lifecycle in the operation store.
+
+    The record is written as ``queued`` when created, ``running`` once the
+    background work starts, after every reported stage, and finally with the
+    result. While in flight ``status`` stays "processing" so existing pollers
+    keep waiting; ``state``, ``stage``, ``progress`` and ``timings`` describe
+    where the operation is and where its time went.
+    """
+
+    def __init__(self, operation_id: str, id_field: str = "operation_id", **fields):
+        self.operation_id = operation_id
+        self.id_field = id_field
+        now = time.time()
+        self._created = time.monotonic()
+        self._started = None
+        self._stage_started = None
+        self._partial_written = 0.0
+        self.timings = {"created_at": now, "started_at": None, "finished_at": None, "stages": {}}
+        self.record = {
+            "status": "processing",
+            "state": "queued",
+            id_field: operation_id,
+            "stage": None,
+            "progress": {},
+            "timings": self.timings,
+            **fields,
+        }
+        set_operation(operation_id, self.record)
+
+    def start(self):
+        """Mark the operation as running."""
+        self._started = self._stage_started = time.monotonic()
+        self.timings["started_at"] = time.time()
+        self.timings["queue_seconds"] = self._started - self._created
+        self.record["state"] = "running"
+        set_operation(self.operation_id, self.record)
+
+    def stage(self, name: str, **info: Any):
+        """Record that ``name`` finished, with optional details such as counts."""
+        if self._started is None:
+            self.start()
+        now = time.monotonic()
+        # Repeated stages (e.g. one per reviewed file) accumulate their time.
+        stages = self.timings["stages"]
+        stages[name] = stages.get(name, 0.0) + (now - self._stage_started)
+        self._stage_started = now
+        self.record["stage"] = name
+        self.record["progress"].update(info)
+        set_operation(self.operation_id, self.record)
+
+    def partial(self, output: str):
+        """Publish partial output (e.g. a streaming LLM response) of a running operation.
+
+        Writes are throttled to one per PARTIAL_OUTPUT_INTERVAL; the complete
+        output arrives with ``finish``.
+        """
+        self.record["partial_output"] = output
+        now = time.monotonic()
+        if now - self._partial_written >= PARTIAL_OUTPUT_INTERVAL:
+            self._partial_written = now
+            set_operation(self.operation_id, self.record)
+
+    def __call__(self, name: str, **info: Any):
+        self.stage(name, **info)
+
+    def finish(self, result: Optional[Dict[str, Any]]):
+        """Write the final result, annotated with the collected timings."""
+        now = time.monotonic()
+        self.timings["finished_at"] = time.time()
+        self.timings["run_seconds"] = now - self._started if self._started is not None else 0.0
+        self.timings["total_seconds"] = now - self._created
+        final = dict(result or {})
+        final.setdefault(self.id_field, self.operation_id)
+        final["state"] = "error" if final.get("status") == "error" else "completed"
+        final["progress"] = self.record["progress"]
+        final["timings"] = self.timings
+        self.record = final
+        set_operation(self.operation_id, final)
+
+    def fail(self, error: Exception, **fields: Any):
+        """Finish with an error result for an exception the work did not handle."""
+        print(f"[OperationProgress] {self.operation_id} failed: {error}")
+        self.finish({"status": "error", "message": str(error), **fields})
+
+    @property
+    def done(self) -> bool:
+        return self.record["state"] in ("completed", "error")
+
+    async def run(self, work: Callable[[], Awaitable[None]], **error_fields: Any):
+        """Run a background task, recording an error result if it raises.
+
+        Without this a failed task would leave the operation "processing"
+        forever; ``error_fields`` are added to that error result.
+        """
+        try:
+            await work()
+        except Exception as e:
+            if not self.done:
+                self.fail(e, **error_fields)
@@ -0,0 +1,84 @@
+import asyncio
+import os
+import time
+from typing import Dict
+
+from operation_store import find_expired_operations, expire_operations, compact_operations
+
+RETENTION_INTERVAL = float(os.getenv("OPERATION_RETENTION_INTERVAL", "300"))
+RETENTION_MAX_AGE = float(os.getenv("OPERATION_RETENTION_MAX_AGE", str(7 * 24 * 3600)))
+RETENTION_BATCH_SIZE = int(os.getenv("OPERATION_RETENTION_BATCH_SIZE", "200"))
+# Seconds between log compaction checks, independent of retention.
+COMPACT_INTERVAL = float(os.getenv("OPERATIONS_COMPACT_INTERVAL", "300"))
+DEFAULT_QUOTAS = "analyze=1000,generate=1000,generateai=500,validate=1000,validateai=500,review=500,deploy=1000"
+
+def _parse_quotas(spec: str) -> Dict[str, int]:
+    """Parse "type=count,type=count" into a quota mapping."""
+    quotas = {}
+    for item in spec.split(","):
+        if not item.strip():
+            continue
+        op_type, _, count = item.partition("=")
+        quotas[op_type.strip()] = int(count)
+    return quotas
+
+RETENTION_QUOTAS = _parse_quotas(os.getenv("OPERATION_RETENTION_QUOTAS", DEFAULT_QUOTAS))
+
+retention_stats = {
+    "runs": 0,
+    "last_run_at": None,
+    "last_run_seconds": None,
+    "last_deleted": 0,
+    "total_deleted": 0,
+}
+
+async def run_retention_pass() -> int:
+    """Expire operations in small batches, each on a worker thread.
+
+    Yielding between batches keeps a large backlog of expired operations
+    from monopolising the event loop or the store lock.
+    """
+    started = time.monotonic()
+    expired = await asyncio.to_thread(
+        find_expired_operations, RETENTION_MAX_AGE, RETENTION_QUOTAS
+    )
+    deleted = 0
+    for start in range(0, len(expired), RETENTION_BATCH_SIZE):
+        deleted += await asyncio.to_thread(
+            expire_operations, expired[start:start + RETENTION_BATCH_SIZE]
+        )
+        await asyncio.sleep(0)
+    retention_stats["runs"] += 1
+    retention_stats["last_run_at"] = time.time()
+    retention_stats["last_run_seconds"] = time.monotonic() - started
+    retention_stats["last_deleted"] = deleted
+    retention_stats["total_deleted"] += deleted
+    if deleted:
+        print(f"[OperationRetention] Expired {deleted} operations")
+    return deleted
+
+async def retention_loop():
+    """Run a retention pass every RETENTION_INTERVAL seconds until cancelled."""
+    while True:
+        try:
+            await run_retention_pass()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"[OperationRetention] Retention pass failed: {e}")
+        await asyncio.sleep(RETENTION_INTERVAL)
+
+async def compaction_loop():
+    """Compact the operation log if needed every COMPACT_INTERVAL seconds until cancelled.
+
+    Log compaction rewrites the whole file, so it runs on a worker thread
+    rather than inside a write on the event loop.
+    """
+    while True:
+        try:
+            await asyncio.to_thread(compact_operations)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"[OperationRetention] Log compaction failed: {e}")
+        await asyncio.sleep(COMPACT_INTERVAL)
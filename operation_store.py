@@ -1,34 +1,495 @@
+import copy
 import json
 import os
-from threading import Lock
+import sqlite3
+import time
+from collections import OrderedDict
+from threading import Lock, local
 
+# Legacy whole-file store; imported into the log the first time it is opened.
 OPERATIONS_FILE = os.path.join(os.path.dirname(__file__), "operations.json")
-_lock = Lock()
+OPERATIONS_LOG = os.getenv("OPERATIONS_LOG", os.path.join(os.path.dirname(__file__), "operations.log"))
+OPERATIONS_DB = os.getenv("OPERATIONS_DB", os.path.join(os.path.dirname(__file__), "operations.db"))
 
-def _read_operations():
-    if not os.path.exists(OPERATIONS_FILE):
-        return {}
-    with _lock, open(OPERATIONS_FILE, "r") as f:
+# PRAGMA user_version of the SQLite store once the legacy file was imported.
+SCHEMA_VERSION = 1
+
+# "log" (single process) or "sqlite" (safe across uvicorn workers).
+STORE_BACKEND = os.getenv("OPERATION_STORE_BACKEND", "log").lower()
+
+# Compact once at least this many dead records exist and they outnumber
+# live records by COMPACT_RATIO. Checked every OPERATIONS_COMPACT_INTERVAL seconds.
+COMPACT_MIN_DEAD = int(os.getenv("OPERATIONS_COMPACT_MIN_DEAD", "1000"))
+COMPACT_RATIO = float(os.getenv("OPERATIONS_COMPACT_RATIO", "1.0"))
+
+# Hot cache in front of the backend. Completed operations are evicted
+# COMPLETED_TTL seconds after they were cached. In-flight operations are
+# re-read after ACTIVE_TTL seconds when other workers may be writing them
+# (sqlite backend); with the single-process log backend the cache is always
+# coherent, so they never expire.
+CACHE_SIZE = int(os.getenv("OPERATION_CACHE_SIZE", "1024"))
+CACHE_COMPLETED_TTL = float(os.getenv("OPERATION_CACHE_COMPLETED_TTL", "300"))
+CACHE_ACTIVE_TTL = float(os.getenv("OPERATION_CACHE_ACTIVE_TTL", "1" if STORE_BACKEND == "sqlite" else "0")) or None
+
+
+class AppendLogStore:
+    """Append-only JSON-lines operation log with an in-memory offset index.
+
+    Every write appends one record (or a tombstone for deletes), so writes
+    cost O(record) instead of O(history). Reads seek straight to the latest
+    record for an operation. Superseded records are dropped by compaction.
+    """
+
+    def __init__(self, path: str, legacy_path: str = None):
+        self.path = path
+        self.legacy_path = legacy_path
+        self._lock = Lock()
+        self._compact_lock = Lock()
+        self._index = {}  # op_id -> (offset, length, updated_at)
+        self._dead = 0
+        self._reader = None
+        self._writer = None
+
+    def _open(self):
+        if self._writer is not None:
+            return
+        if not os.path.exists(self.path):
+            self._import_legacy()
+        self._writer = open(self.path, "ab")
+        self._reader = open(self.path, "rb")
+        self._load_index()
+
+    def _import_legacy(self):
+        ops, ts = _read_legacy_operations(self.legacy_path)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            for op_id, data in ops.items():
+                f.write(self._encode({"id": op_id, "ts": ts, "data": data}))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+    def _load_index(self):
+        self._index = {}
+        self._dead = 0
+        offset = 0
+        self._reader.seek(0)
+        for line in self._reader:
+            if not line.endswith(b"\n"):
+                # A crash mid-append leaves a partial last record; drop it.
+                self._writer.truncate(offset)
+                break
+            try:
+                record = json.loads(line)
+                op_id = record["id"]
+            except (ValueError, KeyError, TypeError):
+                # A complete but unreadable record: skip it and keep the rest.
+                # Compaction drops it from the file.
+                print(f"[OperationStore] Skipping corrupt record at offset {offset} of {self.path}")
+                self._dead += 1
+                offset += len(line)
+                continue
+            if op_id in self._index:
+                self._dead += 1
+            if record.get("deleted"):
+                self._index.pop(op_id, None)
+                self._dead += 1
+            else:
+                self._index[op_id] = (offset, len(line), record.get("ts", 0))
+            offset += len(line)
+
+    @staticmethod
+    def _encode(record) -> bytes:
+        return (json.dumps(record, separators=(",", ":")) + "\n").encode("utf-8")
+
+    def _append(self, record) -> tuple:
+        line = self._encode(record)
+        offset = self._writer.seek(0, os.SEEK_END)
+        self._writer.write(line)
+        self._writer.flush()
+        return offset, len(line), record.get("ts", 0)
+
+    def _read_at(self, offset: int, length: int):
+        self._reader.seek(offset)
+        return json.loads(self._reader.read(length))
+
+    def get(self, op_id):
+        with self._lock:
+            self._open()
+            entry = self._index.get(op_id)
+            if entry is None:
+                return None
+            return self._read_at(entry[0], entry[1])["data"]
+
+    def set(self, op_id, data):
+        with self._lock:
+            self._open()
+            if op_id in self._index:
+                self._dead += 1
+            self._index[op_id] = self._append({"id": op_id, "ts": time.time(), "data": data})
+
+    def delete(self, op_id):
+        with self._lock:
+            self._open()
+            if op_id not in self._index:
+                return
+            self._append({"id": op_id, "deleted": True})
+            del self._index[op_id]
+            self._dead += 2
+
+    def list(self, prefix: str = None, since: float = None, until: float = None) -> list:
+        """Return (op_id, updated_at) pairs, oldest first."""
+        with self._lock:
+            self._open()
+            items = [
+                (op_id, entry[2]) for op_id, entry in self._index.items()
+                if (prefix is None or op_id.startswith(prefix))
+                and (since is None or entry[2] >= since)
+                and (until is None or entry[2] < until)
+            ]
+        return sorted(items, key=lambda item: item[1])
+
+    def compact_if_needed(self) -> bool:
+        """Compact once dead records pass the thresholds; returns whether it ran."""
+        with self._lock:
+            self._open()
+            if self._dead < COMPACT_MIN_DEAD or self._dead < len(self._index) * COMPACT_RATIO:
+                return False
+        self.compact()
+        return True
+
+    def compact(self):
+        """Rewrite the log with only the latest record of each live operation.
+
+        Live records are copied without holding the lock, so writers only
+        wait for the final step, which copies records appended meanwhile
+        and swaps the files. Meant to run off the event loop.
+        """
+        with self._compact_lock:
+            self._compact()
+
+    def _compact(self):
+        with self._lock:
+            self._open()
+            snapshot = list(self._index.items())
+            end = self._writer.seek(0, os.SEEK_END)
+        tmp_path = self.path + ".tmp"
+        new_index = {}
+        offset = 0
+        with open(self.path, "rb") as src, open(tmp_path, "wb") as f:
+            for op_id, (old_offset, length, updated_at) in snapshot:
+                src.seek(old_offset)
+                f.write(src.read(length))
+                new_index[op_id] = (offset, length, updated_at)
+                offset += length
+            with self._lock:
+                # Replay whatever was appended since the snapshot
+                dead = 0
+                src.seek(end)
+                for line in src:
+                    record = json.loads(line)
+                    if record["id"] in new_index:
+                        dead += 1
+                    f.write(line)
+                    if record.get("deleted"):
+                        # Keep the tombstone: the copied record may predate it
+                        new_index.pop(record["id"], None)
+                        dead += 1
+                    else:
+                        new_index[record["id"]] = (offset, len(line), record.get("ts", 0))
+                    offset += len(line)
+                f.flush()
+                os.fsync(f.fileno())
+                self._writer.close()
+                self._reader.close()
+                os.replace(tmp_path, self.path)
+                self._writer = open(self.path, "ab")
+                self._reader = open(self.path, "rb")
+                self._index = new_index
+                self._dead = dead
+
+    def stats(self) -> dict:
+        with self._lock:
+            self._open()
+            return {
+                "backend": "log",
+                "operations": len(self._index),
+                "dead_records": self._dead,
+                "bytes": os.path.getsize(self.path),
+            }
+
+
+class SQLiteStore:
+    """SQLite operation table in WAL mode.
+
+    Each write is a single-row upsert, so several uvicorn workers can share
+    one database file without the read-modify-write race of a JSON blob.
+    Connections are per thread; WAL lets readers proceed during writes.
+    """
+
+    def __init__(self, path: str, legacy_path: str = None):
+        self.path = path
+        self.legacy_path = legacy_path
+        self._local = local()
+        self._init_lock = Lock()
+        self._initialized = False
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=30000")
+            self._local.conn = conn
+            self._initialize(conn)
+        return conn
+
+    def _initialize(self, conn: sqlite3.Connection):
+        with self._init_lock:
+            if self._initialized:
+                return
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS operations (
+                    op_id TEXT PRIMARY KEY,
+                    op_type TEXT NOT NULL,
+                    updated_at REAL NOT NULL,
+                    data TEXT NOT NULL
+                )"""
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_operations_type_time ON operations (op_type, updated_at)"
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_operations_time ON operations (updated_at)"
+            )
+            # user_version records that the legacy file was imported, so an
+            # emptied table (retention, deletes) is not refilled on restart.
+            if conn.execute("PRAGMA user_version").fetchone()[0] < SCHEMA_VERSION:
+                conn.execute("BEGIN IMMEDIATE")
+                try:
+                    # Re-check under the write lock; another worker may have won
+                    if conn.execute("PRAGMA user_version").fetchone()[0] < SCHEMA_VERSION:
+                        if conn.execute("SELECT 1 FROM operations LIMIT 1").fetchone() is None:
+                            ops, ts = _read_legacy_operations(self.legacy_path)
+                            conn.executemany(
+                                "INSERT OR IGNORE INTO operations (op_id, op_type, updated_at, data) VALUES (?, ?, ?, ?)",
+                                [(op_id, _op_type(op_id), ts, json.dumps(data)) for op_id, data in ops.items()],
+                            )
+                        conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+                    conn.execute("COMMIT")
+                except Exception:
+                    conn.execute("ROLLBACK")
+                    raise
+            self._initialized = True
+
+    def get(self, op_id):
+        row = self._conn().execute(
+            "SELECT data FROM operations WHERE op_id = ?", (op_id,)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set(self, op_id, data):
+        self._conn().execute(
+            """INSERT INTO operations (op_id, op_type, updated_at, data) VALUES (?, ?, ?, ?)
+               ON CONFLICT(op_id) DO UPDATE SET updated_at = excluded.updated_at, data = excluded.data""",
+            (op_id, _op_type(op_id), time.time(), json.dumps(data)),
+        )
+
+    def delete(self, op_id):
+        self._conn().execute("DELETE FROM operations WHERE op_id = ?", (op_id,))
+
+    def list(self, prefix: str = None, since: float = None, until: float = None) -> list:
+        """Return (op_id, updated_at) pairs, oldest first."""
+        clauses, params = [], []
+        if prefix is not None:
+            # Operation IDs are "<type>_<suffix>", so whole-type prefixes hit the index.
+            if prefix.endswith("_") and "_" not in prefix[:-1]:
+                clauses.append("op_type = ?")
+                params.append(prefix[:-1])
+            else:
+                clauses.append("substr(op_id, 1, ?) = ?")
+                params.extend([len(prefix), prefix])
+        if since is not None:
+            clauses.append("updated_at >= ?")
+            params.append(since)
+        if until is not None:
+            clauses.append("updated_at < ?")
+            params.append(until)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        return self._conn().execute(
+            f"SELECT op_id, updated_at FROM operations {where} ORDER BY updated_at", params
+        ).fetchall()
+
+    def compact_if_needed(self) -> bool:
+        # SQLite reuses freed pages itself
+        return False
+
+    def stats(self) -> dict:
+        conn = self._conn()
+        count = conn.execute("SELECT COUNT(*) FROM operations").fetchone()[0]
+        pages = conn.execute("PRAGMA page_count").fetchone()[0]
+        page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+        return {
+            "backend": "sqlite",
+            "operations": count,
+            "bytes": pages * page_size,
+        }
+
+
+class OperationCache:
+    """Bounded LRU cache of operations with age-based expiry."""
+
+    def __init__(self, max_size: int, completed_ttl: float, active_ttl: float = None):
+        self.max_size = max_size
+        self.completed_ttl = completed_ttl
+        self.active_ttl = active_ttl
+        self._entries = OrderedDict()  # op_id -> (data, expires_at)
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, op_id):
+        with self._lock:
+            entry = self._entries.get(op_id)
+            if entry is not None and entry[1] is not None and entry[1] <= time.monotonic():
+                del self._entries[op_id]
+                self.evictions += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(op_id)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, op_id, data):
+        if self.max_size <= 0:
+            return
+        ttl = self.active_ttl if _is_active(data) else self.completed_ttl
+        expires_at = time.monotonic() + ttl if ttl is not None else None
+        with self._lock:
+            self._entries[op_id] = (data, expires_at)
+            self._entries.move_to_end(op_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def discard(self, op_id):
+        with self._lock:
+            self._entries.pop(op_id, None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+def _is_active(data) -> bool:
+    return isinstance(data, dict) and data.get("status") == "processing"
+
+def _op_type(op_id: str) -> str:
+    return op_id.split("_", 1)[0]
+
+def _read_legacy_operations(path: str) -> tuple:
+    """Load the legacy operations.json, returning (ops, mtime)."""
+    if not path or not os.path.exists(path):
+        return {}, 0
+    with open(path, "r") as f:
         try:
-            return json.load(f)
+            return json.load(f), os.path.getmtime(path)
         except Exception:
-            return {}
+            return {}, 0
+
+def _create_store():
+    if STORE_BACKEND == "sqlite":
+        return SQLiteStore(OPERATIONS_DB, legacy_path=OPERATIONS_FILE)
+    if STORE_BACKEND == "log":
+        return AppendLogStore(OPERATIONS_LOG, legacy_path=OPERATIONS_FILE)
+    raise ValueError(f"Unknown OPERATION_STORE_BACKEND: {STORE_BACKEND}")
 
-def _write_operations(ops):
-    with _lock, open(OPERATIONS_FILE, "w") as f:
-        json.dump(ops, f)
+_store = _create_store()
+_cache = OperationCache(CACHE_SIZE, CACHE_COMPLETED_TTL, CACHE_ACTIVE_TTL)
+_listeners = []
+
+def add_listener(listener):
+    """Register ``listener(op_id, data)`` to be called after every set_operation."""
+    _listeners.append(listener)
 
 def get_operation(op_id):
-    ops = _read_operations()
-    return ops.get(op_id)
+    data = _cache.get(op_id)
+    if data is None:
+        data = _store.get(op_id)
+        if data is not None:
+            _cache.put(op_id, data)
+    return data
 
 def set_operation(op_id, data):
-    ops = _read_operations()
-    ops[op_id] = data
-    _write_operations(ops)
+    _store.set(op_id, data)
+    # Cache a private copy so later mutation by the caller can't leak in.
+    _cache.put(op_id, copy.deepcopy(data))
+    for listener in _listeners:
+        try:
+            listener(op_id, data)
+        except Exception as e:
+            print(f"[OperationStore] Listener failed for {op_id}: {e}")
 
 def delete_operation(op_id):
-    ops = _read_operations()
-    if op_id in ops:
-        del ops[op_id]
-        _write_operations(ops) 
\ No newline at end of file
+    _store.delete(op_id)
+    _cache.discard(op_id)
+
+def compact_operations():
+    """Compact the backend if it needs it (blocking; call off the event loop)."""
+    return _store.compact_if_needed()
+
+def find_expired_operations(max_age=None, quotas=None, now=None):
+    """Return (op_id, reason) pairs outside the retention policy, oldest first.
+
+    Operations last updated more than ``max_age`` seconds ago expire with
+    reason "age". ``quotas`` maps an operation type (the ID prefix) to how many
+    of its most recent operations to keep; older ones expire with reason "quota".
+    """
+    now = now if now is not None else time.time()
+    quotas = quotas or {}
+    expired, by_type = [], {}
+    for op_id, updated_at in _store.list():
+        if max_age and updated_at < now - max_age:
+            expired.append((op_id, "age"))
+        else:
+            by_type.setdefault(_op_type(op_id), []).append(op_id)
+    for op_type, op_ids in by_type.items():
+        quota = quotas.get(op_type)
+        if quota is not None and len(op_ids) > quota:
+            expired.extend((op_id, "quota") for op_id in op_ids[:len(op_ids) - quota])
+    return expired
+
+def expire_operations(expired):
+    """Delete operations returned by find_expired_operations.
+
+    Quota victims that are still in flight are spared; an operation that has
+    outlived max_age is gone regardless, since nothing is still running it.
+    """
+    deleted = 0
+    for op_id, reason in expired:
+        if reason == "quota":
+            # Read the backend directly so sweeping old operations doesn't churn the cache.
+            data = _store.get(op_id)
+            if data is None or _is_active(data):
+                continue
+        delete_operation(op_id)
+        deleted += 1
+    return deleted
+
+def cache_stats():
+    return _cache.stats()
+
+def store_stats():
+    return _store.stats()